@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Runs main.py end to end against fake_slack.py and reports how long it took and which API calls it made.
+
+    python3 benchmark.py --channels 1000 10000 50000 --workers 8
+
+Can also time just the exemption rules, with no API calls:
+
+    python3 benchmark.py --rules 100000
+
+Nothing here touches a real Slack workspace.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from fake_slack import Workspace, start_server
+from rules import ExemptionRules
+from typing import Dict, List
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+
+def run_benchmark(
+        channels: int,
+        users: int = 5000,
+        workers: int = 1,
+        rate_scale: float = 50.0,
+        latency_ms: float = 20.0,
+        jitter_ms: float = 0.0,
+        seed: int = 0,
+        env: Dict = None,
+) -> Dict:
+    """
+    Runs main.py once as a dry run against a freshly generated fake workspace.
+    The run uses a temporary directory, so caches and state from other runs are not used.
+
+    :param channels: Number of channels in the workspace.
+    :param users: Number of users in the workspace.
+    :param workers: WORKERS to run main.py with.
+    :param rate_scale: Multiplier for Slack's rate limits, used by both the fake API and the script.
+        0 = no rate limits.
+    :param latency_ms: Delay the fake API adds to every response.
+    :param jitter_ms: Random extra delay of up to this much.
+    :param seed: Random seed for the workspace.
+    :param env: Any other env vars to run main.py with.
+    :return: Dict with the wall time, exit code and per method call counts.
+    """
+    workspace = Workspace(channels=channels, users=users, seed=seed)
+    server = start_server(workspace, rate_scale=rate_scale, latency_ms=latency_ms, jitter_ms=jitter_ms)
+
+    run_env = dict(
+        os.environ,
+        API_TOKEN='fake-token',
+        SLACK_API_URL=server.url,
+        DRY_RUN='True',
+        WORKERS=str(workers),
+        # The script paces itself to the same scaled limits as the fake API
+        RATE_LIMIT_PERCENT=str(int(90 * rate_scale)) if rate_scale else '1000000',
+    )
+    run_env.update(env or {})
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.perf_counter()
+            process = subprocess.run(
+                [sys.executable, MAIN], cwd=tmp, env=run_env,
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            )
+            wall_time = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    stats = server.get_stats()
+
+    return {
+        'channels': channels,
+        'users': users,
+        'workers': workers,
+        'rate_scale': rate_scale,
+        'latency_ms': latency_ms,
+        'wall_time': round(wall_time, 3),
+        'exit_code': process.returncode,
+        'stderr': process.stderr.decode(errors='replace')[-2000:],
+        'total_calls': sum(counts['calls'] for counts in stats.values()),
+        'total_rate_limited': sum(counts['rate_limited'] for counts in stats.values()),
+        'methods': stats,
+    }
+
+
+def benchmark_rules(
+        channels: int = 100000,
+        exempt_names: int = 1000,
+        patterns: int = 50,
+        keywords: int = 100,
+) -> Dict:
+    """
+    Times ExemptionRules against generated channel names, topics and purposes.
+
+    :param channels: Number of channels to evaluate.
+    :param exempt_names: Number of exact exempt channel names.
+    :param patterns: Number of glob patterns.
+    :param keywords: Number of topic and purpose keywords.
+    :return: Dict with the compile and evaluation times in milliseconds.
+    """
+    start = time.perf_counter()
+    rules = ExemptionRules(
+        exempt_channels=[f'channel-{i * 7}' for i in range(exempt_names)] + [f'proj{i}-*' for i in range(patterns)],
+        keywords=[f'%keep{i}' for i in range(keywords)],
+    )
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    data = [
+        (f'channel-{i}', f'Topic for channel {i}' + (f' %keep{i % keywords}' if i % 50 == 0 else ''),
+         f'Purpose of channel {i}')
+        for i in range(channels)
+    ]
+
+    start = time.perf_counter()
+    exempt = sum(
+        1 for name, topic, purpose in data
+        if rules.name_reason(name) or rules.text_reason(topic, purpose)
+    )
+    evaluate_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        'channels': channels,
+        'exempt': exempt,
+        'compile_ms': round(compile_ms, 3),
+        'evaluate_ms': round(evaluate_ms, 3),
+    }
+
+
+def print_report(result: Dict) -> None:
+    """
+    Prints a single benchmark result as a table.
+
+    :param result: Result from run_benchmark().
+    :return: None
+    """
+    print(f"\n{result['channels']} channels, {result['users']} users, {result['workers']} worker(s), "
+          f"rate scale {result['rate_scale']}, latency {result['latency_ms']} ms")
+    print(f"Wall time: {result['wall_time']:.2f} s    Exit code: {result['exit_code']}")
+    print(f"{'Method':<28}{'Calls':>10}{'429s':>10}")
+    print('-' * 48)
+
+    for method, counts in sorted(result['methods'].items()):
+        print(f"{method:<28}{counts['calls']:>10}{counts['rate_limited']:>10}")
+
+    print('-' * 48)
+    print(f"{'Total':<28}{result['total_calls']:>10}{result['total_rate_limited']:>10}")
+
+    if result['exit_code']:
+        print(result['stderr'])
+
+    return None
+
+
+def main(argv: List[str] = None) -> List[Dict]:
+    parser = argparse.ArgumentParser(description='Benchmarks main.py against a fake Slack API.')
+    parser.add_argument('--channels', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rate-scale', type=float, default=50.0,
+                        help='Multiplier for Slack rate limits. 0 = no rate limits.')
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Also write the results to this file.')
+    parser.add_argument('--rules', type=int, metavar='CHANNELS',
+                        help='Only time the exemption rules against this many channels.')
+    args = parser.parse_args(argv)
+
+    if args.rules:
+        result = benchmark_rules(args.rules)
+        print(f"Exemption rules: compiled in {result['compile_ms']:.1f} ms. "
+              f"Evaluated {result['channels']} channels in {result['evaluate_ms']:.1f} ms "
+              f"({result['exempt']} exempt).")
+        return [result]
+
+    results = []
+    for channels in args.channels:
+        result = run_benchmark(
+            channels=channels,
+            users=args.users,
+            workers=args.workers,
+            rate_scale=args.rate_scale,
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            seed=args.seed,
+        )
+        print_report(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, mode='w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
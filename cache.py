@@ -0,0 +1,808 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Keyed by absolute path, so the same relative path opens a new store after a chdir. Ex. multi_workspace.py
+_user_caches = {}  # One UserCache per absolute file path
+_user_caches_lock = threading.Lock()
+_state_stores = {}  # One ChannelStateStore per absolute file path
+_state_stores_lock = threading.Lock()
+_channel_caches = {}  # One ChannelListCache per absolute file path
+_channel_caches_lock = threading.Lock()
+_checkpoints = {}  # One CheckpointStore per absolute file path
+_checkpoints_lock = threading.Lock()
+_archived_indexes = {}  # One ArchivedIndex per absolute file path
+_archived_indexes_lock = threading.Lock()
+
+
+def get_user_name(user: Dict) -> str:
+    """
+    Returns the display name used in reports for the given user object.
+
+    :param user: User object from users.list or users.info
+    :return: str: The user's real name
+    """
+    return user.get('profile', {}).get('real_name', '')
+
+
+class UserCache:
+    """
+    Local copy of the workspace user directory stored in SQLite.
+    Lets member IDs be resolved to names without making any API calls.
+    """
+
+    def __init__(self, path: str, ttl_hours: int):
+        """
+        :param path: SQLite file to store the directory in.
+        :param ttl_hours: How long a loaded directory is considered fresh.
+        """
+        self.path = path
+        self.ttl_seconds = ttl_hours * 3600
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+
+        with self._lock, self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id TEXT PRIMARY KEY,
+                    real_name TEXT NOT NULL,
+                    updated INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            ''')
+
+    def loaded_at(self) -> float:
+        """
+        :return: float: Epoch time the directory was last fully loaded. 0 if never.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'loaded_at'"
+            ).fetchone()
+
+        return float(row[0]) if row else 0.0
+
+    def is_stale(self) -> bool:
+        """
+        :return: bool: True if the directory should be reloaded from the API.
+        """
+        return time.time() - self.loaded_at() >= self.ttl_seconds
+
+    def mark_loaded(self) -> None:
+        """
+        Records that the directory was just fully loaded.
+
+        :return: None
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('loaded_at', ?)",
+                (str(time.time()),)
+            )
+
+        return None
+
+    def upsert(self, users: Iterable[Dict]) -> int:
+        """
+        Adds the given users to the directory.
+        Existing rows are only rewritten if the user's "updated" time is newer,
+        so a refresh of an already loaded directory touches very few rows.
+
+        :param users: User objects from users.list or users.info
+        :return: int: Number of rows added or changed.
+        """
+        rows = [
+            (user['id'], get_user_name(user), int(user.get('updated', 0)))
+            for user in users
+        ]
+
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany('''
+                INSERT INTO users (id, real_name, updated) VALUES (?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    real_name = excluded.real_name,
+                    updated = excluded.updated
+                WHERE excluded.updated > users.updated
+            ''', rows)
+            changed = self._conn.total_changes - before
+
+        return changed
+
+    def get_name(self, user_id: str) -> Optional[str]:
+        """
+        :param user_id: Slack user ID.
+        :return: The user's name, or None if the user is not in the directory.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT real_name FROM users WHERE id = ?', (user_id,)
+            ).fetchone()
+
+        return row[0] if row else None
+
+    def close(self) -> None:
+        """
+        Closes the underlying database connection.
+
+        :return: None
+        """
+        with self._lock:
+            self._conn.close()
+
+        return None
+
+
+def get_user_cache(path: str, ttl_hours: int) -> UserCache:
+    """
+    Returns the shared UserCache for the given file, opening it on first use.
+
+    :param path: SQLite file to store the directory in.
+    :param ttl_hours: How long a loaded directory is considered fresh.
+    :return: UserCache
+    """
+    path = os.path.abspath(path)
+    with _user_caches_lock:
+        if path not in _user_caches:
+            _user_caches[path] = UserCache(path, ttl_hours)
+
+    return _user_caches[path]
+
+
+class ChannelStateStore:
+    """
+    Remembers what was learned about each channel on previous runs, keyed by channel ID.
+    Lets a run skip conversations.history for channels that were recently proven active.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: SQLite file to store channel state in.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+
+        with self._lock, self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS channel_state (
+                    id TEXT PRIMARY KEY,
+                    last_message_ts REAL,
+                    verdict TEXT NOT NULL,
+                    updated INTEGER NOT NULL DEFAULT 0,
+                    checked_at REAL NOT NULL
+                )
+            ''')
+
+    def get(self, channel_id: str) -> Optional[Dict]:
+        """
+        :param channel_id: Slack channel ID.
+        :return: The stored state of the channel, or None if it was never checked.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT * FROM channel_state WHERE id = ?', (channel_id,)
+            ).fetchone()
+
+        return dict(row) if row else None
+
+    def record(
+            self,
+            channel_id: str,
+            last_message_ts: Optional[float],
+            verdict: str,
+            updated: int = 0
+    ) -> None:
+        """
+        Saves the result of checking a channel's history.
+
+        :param channel_id: Slack channel ID.
+        :param last_message_ts: Time of the latest message that counts as activity. None if there wasn't one.
+        :param verdict: Ex. "active" or "inactive"
+        :param updated: The channel's "updated" field from conversations.list
+        :return: None
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                '''
+                INSERT OR REPLACE INTO channel_state (id, last_message_ts, verdict, updated, checked_at)
+                VALUES (?, ?, ?, ?, ?)
+                ''',
+                (channel_id, last_message_ts, verdict, int(updated or 0), time.time())
+            )
+
+        return None
+
+    def close(self) -> None:
+        """
+        Closes the underlying database connection.
+
+        :return: None
+        """
+        with self._lock:
+            self._conn.close()
+
+        return None
+
+
+def get_state_store(path: str) -> ChannelStateStore:
+    """
+    Returns the shared ChannelStateStore for the given file, opening it on first use.
+
+    :param path: SQLite file to store channel state in.
+    :return: ChannelStateStore
+    """
+    path = os.path.abspath(path)
+    with _state_stores_lock:
+        if path not in _state_stores:
+            _state_stores[path] = ChannelStateStore(path)
+
+    return _state_stores[path]
+
+
+class ArchivedIndex:
+    """
+    Channels archived by recent runs, keyed by channel ID.
+    A channel from this index that shows up again in a listing of unarchived channels was unarchived,
+    so unarchive churn can be reported without listing archived channels.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: SQLite file to store the index in. Can be the same file as ChannelStateStore.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+
+        with self._lock, self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS archived_channels (
+                    id TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    archived_at REAL NOT NULL,
+                    unarchived_at REAL
+                )
+            ''')
+
+    def record(self, channel_id: str, name: str) -> None:
+        """
+        Saves that the given channel was just archived.
+        If it had been unarchived before, that is kept for the churn report.
+
+        :param channel_id: Slack channel ID.
+        :param name: Channel name.
+        :return: None
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                '''
+                INSERT INTO archived_channels (id, name, archived_at) VALUES (?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET name = excluded.name, archived_at = excluded.archived_at
+                ''',
+                (channel_id, name, time.time())
+            )
+
+        return None
+
+    def mark_unarchived(self, channels: Iterable[Tuple[str, float]]) -> List[Dict]:
+        """
+        Checks a listing of unarchived channels against the index.
+        Only channels listed after they were archived count. Channels listed at an unknown time (0) never do.
+
+        :param channels: (ID, time it was listed) of channels that are not archived.
+        :return: The archived channels from the index that are among them, now marked as unarchived.
+        """
+        with self._lock, self._conn:
+            archived = {
+                row['id']: dict(row)
+                for row in self._conn.execute(
+                    'SELECT * FROM archived_channels WHERE unarchived_at IS NULL OR unarchived_at < archived_at'
+                )
+            }
+            unarchived = []
+            for channel_id, listed_at in channels:
+                if channel_id in archived and listed_at > archived[channel_id]['archived_at']:
+                    unarchived.append(dict(archived[channel_id], unarchived_at=listed_at))
+
+            self._conn.executemany(
+                'UPDATE archived_channels SET unarchived_at = ? WHERE id = ?',
+                [(channel['unarchived_at'], channel['id']) for channel in unarchived]
+            )
+
+        return unarchived
+
+    def unarchived_since(self, since: float) -> List[Dict]:
+        """
+        :param since: Epoch time.
+        :return: Channels archived by a run and found unarchived since the given time, most recent first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT * FROM archived_channels WHERE unarchived_at >= ? ORDER BY unarchived_at DESC',
+                (since,)
+            ).fetchall()
+
+        return [dict(row) for row in rows]
+
+    def archived_since(self, since: float) -> int:
+        """
+        :param since: Epoch time.
+        :return: int: Number of channels archived since the given time.
+        """
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM archived_channels WHERE archived_at >= ?', (since,)
+            ).fetchone()[0]
+
+    def prune(self, before: float) -> int:
+        """
+        Forgets channels archived before the given time.
+
+        :param before: Epoch time.
+        :return: int: Number of channels forgotten.
+        """
+        with self._lock, self._conn:
+            return self._conn.execute(
+                'DELETE FROM archived_channels WHERE archived_at < ?', (before,)
+            ).rowcount
+
+    def close(self) -> None:
+        """
+        Closes the underlying database connection.
+
+        :return: None
+        """
+        with self._lock:
+            self._conn.close()
+
+        return None
+
+
+def get_archived_index(path: str) -> ArchivedIndex:
+    """
+    Returns the shared ArchivedIndex for the given file, opening it on first use.
+
+    :param path: SQLite file to store the index in.
+    :return: ArchivedIndex
+    """
+    path = os.path.abspath(path)
+    with _archived_indexes_lock:
+        if path not in _archived_indexes:
+            _archived_indexes[path] = ArchivedIndex(path)
+
+    return _archived_indexes[path]
+
+
+class ChannelListCache:
+    """
+    Snapshot of conversations.list results saved to SQLite.
+    Each listing (ex. public only, public and private) is saved separately with the time it was fetched.
+    Pages are written as they are listed and read back a chunk at a time, so a listing is never all in memory.
+    Channels are indexed by name, so names can be resolved without listing the workspace.
+    """
+
+    def __init__(self, path: str, ttl_minutes: int):
+        """
+        :param path: SQLite file to save the snapshot in.
+        :param ttl_minutes: How long a saved listing is considered fresh.
+        """
+        self.path = path
+        self.ttl_seconds = ttl_minutes * 60
+        self._lock = threading.Lock()
+        self._started = {}  # Listing name: time the listing being written was started
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+
+        with self._lock, self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS listings (
+                    key TEXT PRIMARY KEY,
+                    fetched_at REAL NOT NULL
+                )
+            ''')
+            # Rows of a listing being written have "listing" set to the key + PENDING until it is finished
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS channels (
+                    listing TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    channel TEXT NOT NULL,
+                    PRIMARY KEY (listing, seq)
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS channels_name ON channels (name)')
+
+    PENDING = '#pending'
+    CHUNK = 1000  # Channels read per query
+
+    def _is_fresh(self, fetched_at: Optional[float], max_age: float = None) -> bool:
+        if max_age is None:
+            max_age = self.ttl_seconds
+
+        return fetched_at is not None and time.time() - fetched_at < max_age
+
+    def fetched_at(self, key: str) -> Optional[float]:
+        """
+        :param key: Name of the listing. Ex. "public_channel"
+        :return: When the saved listing was fetched, or None if there is none.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT fetched_at FROM listings WHERE key = ?', (key,)).fetchone()
+
+        return row[0] if row else None
+
+    def get(self, key: str, max_age: float = None) -> Optional[Iterator[Dict]]:
+        """
+        :param key: Name of the listing. Ex. "public_channel"
+        :param max_age: Seconds a saved listing can be old. Defaults to the TTL.
+        :return: Iterator of the saved channels, or None if there is no fresh listing.
+        """
+        if not self._is_fresh(self.fetched_at(key), max_age):
+            return None
+
+        return self._iter_listing(key)
+
+    def count(self, key: str) -> int:
+        """
+        :param key: Name of the listing. Ex. "public_channel"
+        :return: Number of channels in the saved listing.
+        """
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM channels WHERE listing = ?', (key,)).fetchone()[0]
+
+    def _iter_listing(self, listing: str) -> Iterator[Dict]:
+        seq = -1
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    'SELECT seq, channel FROM channels WHERE listing = ? AND seq > ? ORDER BY seq LIMIT ?',
+                    (listing, seq, self.CHUNK)
+                ).fetchall()
+            if not rows:
+                return
+
+            for seq, channel in rows:
+                yield json.loads(channel)
+
+    def start(self, key: str) -> None:
+        """
+        Starts writing a new listing. The saved listing is used until finish() is called.
+
+        :param key: Name of the listing. Ex. "public_channel"
+        :return: None
+        """
+        with self._lock, self._conn:
+            self._started[key] = time.time()
+            self._conn.execute('DELETE FROM channels WHERE listing = ?', (key + self.PENDING,))
+
+        return None
+
+    def add_page(self, key: str, channels: List[Dict]) -> None:
+        """
+        Adds a page of channels to the listing started with start().
+
+        :param key: Name of the listing. Ex. "public_channel"
+        :param channels: Channel dicts. See Channel.to_dict() in channels.py
+        :return: None
+        """
+        listing = key + self.PENDING
+
+        with self._lock, self._conn:
+            seq = self._conn.execute(
+                'SELECT COALESCE(MAX(seq), -1) FROM channels WHERE listing = ?', (listing,)
+            ).fetchone()[0]
+            self._conn.executemany(
+                'INSERT INTO channels (listing, seq, id, name, channel) VALUES (?, ?, ?, ?, ?)',
+                [
+                    (listing, seq + number, channel['id'], channel['name'], json.dumps(channel))
+                    for number, channel in enumerate(channels, start=1)
+                ]
+            )
+
+        return None
+
+    def finish(self, key: str) -> None:
+        """
+        Replaces the saved listing with the one written since start().
+
+        :param key: Name of the listing. Ex. "public_channel"
+        :return: None
+        """
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM channels WHERE listing = ?', (key,))
+            self._conn.execute('UPDATE channels SET listing = ? WHERE listing = ?', (key, key + self.PENDING))
+            self._conn.execute(
+                'INSERT OR REPLACE INTO listings (key, fetched_at) VALUES (?, ?)',
+                (key, self._started.pop(key, time.time()))
+            )
+
+        return None
+
+    def get_id(self, name: str) -> Optional[str]:
+        """
+        :param name: Channel name without the "#"
+        :return: The channel ID, or None if the name is not in any fresh listing.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                '''
+                SELECT channels.id, listings.fetched_at FROM channels
+                JOIN listings ON listings.key = channels.listing
+                WHERE channels.name = ?
+                ORDER BY listings.fetched_at DESC
+                LIMIT 1
+                ''',
+                (name,)
+            ).fetchone()
+
+        if row is None or not self._is_fresh(row[1]):
+            return None
+
+        return row[0]
+
+    def remove(self, channel_ids: Iterable[str]) -> int:
+        """
+        Drops the given channels from every saved listing. Used after channels are archived.
+        The rest of each listing, and when it was fetched, are kept.
+
+        :param channel_ids: IDs of the channels to drop.
+        :return: int: Number of saved rows removed.
+        """
+        with self._lock, self._conn:
+            return self._conn.executemany(
+                'DELETE FROM channels WHERE id = ?', [(channel_id,) for channel_id in channel_ids]
+            ).rowcount
+
+    def close(self) -> None:
+        """
+        Closes the underlying database connection.
+
+        :return: None
+        """
+        with self._lock:
+            self._conn.close()
+
+        return None
+
+
+def get_channel_cache(path: str, ttl_minutes: int) -> ChannelListCache:
+    """
+    Returns the shared ChannelListCache for the given file.
+
+    :param path: SQLite file to save the snapshot in.
+    :param ttl_minutes: How long a saved listing is considered fresh.
+    :return: ChannelListCache
+    """
+    path = os.path.abspath(path)
+    with _channel_caches_lock:
+        if path not in _channel_caches:
+            _channel_caches[path] = ChannelListCache(path, ttl_minutes)
+
+    return _channel_caches[path]
+
+
+class CheckpointStore:
+    """
+    Progress of the current run saved to SQLite so an interrupted run can be resumed.
+    Keeps:
+    - The conversations.list cursor and every channel listed so far
+    - The decision for every channel evaluated so far, and whether it was archived
+    - Every channel joined so far
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: SQLite file to save progress in.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+
+        with self._lock, self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS listed_channels (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    channel TEXT NOT NULL
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS decisions (
+                    id TEXT PRIMARY KEY,
+                    result TEXT
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS joined_channels (
+                    id TEXT PRIMARY KEY
+                )
+            ''')
+
+    def clear(self) -> None:
+        """
+        Forgets all saved progress. Called when a new run starts and when a run completes.
+
+        :return: None
+        """
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM meta')
+            self._conn.execute('DELETE FROM listed_channels')
+            self._conn.execute('DELETE FROM decisions')
+            self._conn.execute('DELETE FROM joined_channels')
+
+        return None
+
+    def get_listing(self, key: str) -> Tuple[int, Optional[str], bool]:
+        """
+        Returns the saved progress of listing channels. Read the channels with iter_listing().
+
+        :param key: Name of the listing. Ex. "public_channel"
+        :return: Tuple of (number of channels listed so far, cursor for the next page, whether listing finished)
+            Returns (0, None, False) if there is no saved progress for this listing.
+        """
+        with self._lock:
+            meta = dict(self._conn.execute('SELECT key, value FROM meta').fetchall())
+            if meta.get('listing_key') != key:
+                return 0, None, False
+
+            count = self._conn.execute('SELECT COUNT(*) FROM listed_channels').fetchone()[0]
+
+        return count, meta.get('cursor') or None, meta.get('listing_done') == '1'
+
+    def iter_listing(self, key: str) -> Iterator[Dict]:
+        """
+        Yields the channels listed so far, a chunk at a time.
+
+        :param key: Name of the listing. Ex. "public_channel"
+        :return: Iterator of channel dicts. Empty if there is no saved progress for this listing.
+        """
+        seq = 0
+        while True:
+            with self._lock:
+                listing_key = self._conn.execute("SELECT value FROM meta WHERE key = 'listing_key'").fetchone()
+                if not listing_key or listing_key[0] != key:
+                    return
+
+                rows = self._conn.execute(
+                    'SELECT seq, channel FROM listed_channels WHERE seq > ? ORDER BY seq LIMIT ?',
+                    (seq, ChannelListCache.CHUNK)
+                ).fetchall()
+            if not rows:
+                return
+
+            for seq, channel in rows:
+                yield json.loads(channel)
+
+    def start_listing(self, key: str) -> None:
+        """
+        Forgets any saved listing progress before listing the channels from the first page.
+
+        :param key: Name of the listing. Ex. "public_channel"
+        :return: None
+        """
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM listed_channels')
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                [('listing_key', key), ('cursor', ''), ('listing_done', '0')]
+            )
+
+        return None
+
+    def add_page(self, key: str, channels: List[Dict], next_cursor: Optional[str]) -> None:
+        """
+        Saves a page of conversations.list results along with the cursor for the next page.
+
+        :param key: Name of the listing. Ex. "public_channel"
+        :param channels: Channel objects on this page.
+        :param next_cursor: Cursor for the next page. None or empty if this was the last page.
+        :return: None
+        """
+        with self._lock, self._conn:
+            listing_key = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'listing_key'"
+            ).fetchone()
+            if not listing_key or listing_key[0] != key:
+                # Only one listing is checkpointed at a time
+                self._conn.execute('DELETE FROM listed_channels')
+
+            self._conn.executemany(
+                'INSERT INTO listed_channels (channel) VALUES (?)',
+                [(json.dumps(channel),) for channel in channels]
+            )
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                [
+                    ('listing_key', key),
+                    ('cursor', next_cursor or ''),
+                    ('listing_done', '0' if next_cursor else '1'),
+                ]
+            )
+
+        return None
+
+    def get_decision(self, channel_id: str) -> Tuple[bool, Optional[Dict]]:
+        """
+        :param channel_id: Slack channel ID.
+        :return: Tuple of (whether the channel was decided, its result). The result is None for skipped channels.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT result FROM decisions WHERE id = ?', (channel_id,)
+            ).fetchone()
+
+        if row is None:
+            return False, None
+
+        return True, json.loads(row[0]) if row[0] else None
+
+    def save_decision(self, channel_id: str, result: Optional[Dict]) -> None:
+        """
+        Saves the decision for a channel.
+
+        :param channel_id: Slack channel ID.
+        :param result: Result from evaluate_channel(). None if the channel was skipped.
+        :return: None
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO decisions (id, result) VALUES (?, ?)',
+                (channel_id, json.dumps(result) if result is not None else None)
+            )
+
+        return None
+
+
+    def was_joined(self, channel_id: str) -> bool:
+        """
+        :param channel_id: Slack channel ID.
+        :return: bool: True if the channel was joined since the run started.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM joined_channels WHERE id = ?', (channel_id,)).fetchone()
+
+        return row is not None
+
+    def save_joined(self, channel_id: str) -> None:
+        """
+        Saves that a channel was joined, so a resumed run doesn't join it again.
+
+        :param channel_id: Slack channel ID.
+        :return: None
+        """
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR IGNORE INTO joined_channels (id) VALUES (?)', (channel_id,))
+
+        return None
+
+def get_checkpoint(path: str) -> CheckpointStore:
+    """
+    Returns the shared CheckpointStore for the given file, opening it on first use.
+
+    :param path: SQLite file to save progress in.
+    :return: CheckpointStore
+    """
+    path = os.path.abspath(path)
+    with _checkpoints_lock:
+        if path not in _checkpoints:
+            _checkpoints[path] = CheckpointStore(path)
+
+    return _checkpoints[path]
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, Iterable, List
+
+DEBUG_DUMP_LIMIT = 20  # Most channels written to the log by describe()
+
+
+class Channel:
+    """
+    The parts of a conversations.list channel object this script uses.
+    Everything else (previous names, shared team data, topic and purpose metadata, etc.) is dropped
+    as each page is read, so a listing of 100k+ channels stays small in memory.
+    """
+
+    __slots__ = (
+        'id', 'name', 'created', 'updated', 'is_channel', 'is_private', 'is_archived',
+        'is_member', 'num_members', 'topic', 'purpose', 'listed_at',
+    )
+
+    def __init__(
+            self,
+            id: str,
+            name: str,
+            created: float = 0.0,
+            updated: int = 0,
+            is_channel: bool = True,
+            is_private: bool = False,
+            is_archived: bool = False,
+            is_member: bool = False,
+            num_members: int = 0,
+            topic: str = '',
+            purpose: str = '',
+            listed_at: float = 0.0,
+    ):
+        self.id = id
+        self.name = name
+        self.created = created
+        self.updated = updated
+        self.is_channel = is_channel
+        self.is_private = is_private
+        self.is_archived = is_archived
+        self.is_member = is_member
+        self.num_members = num_members
+        self.topic = topic
+        self.purpose = purpose
+        self.listed_at = listed_at  # When conversations.list returned this channel. 0 = unknown.
+
+    @classmethod
+    def from_api(cls, data: Dict) -> 'Channel':
+        """
+        :param data: Channel object from conversations.list, or a dict from to_dict().
+        :return: Channel
+        """
+        topic = data.get('topic') or ''
+        purpose = data.get('purpose') or ''
+
+        return cls(
+            id=data['id'],
+            name=data['name'],
+            created=float(data.get('created') or 0),
+            updated=int(data.get('updated') or 0),
+            is_channel=data.get('is_channel', True),
+            is_private=data.get('is_private', False),
+            is_archived=data.get('is_archived', False),
+            is_member=data.get('is_member', False),
+            num_members=data.get('num_members', 0),
+            # The API nests these as {"value": ..., "creator": ..., "last_set": ...}
+            topic=topic.get('value', '') if isinstance(topic, dict) else topic,
+            purpose=purpose.get('value', '') if isinstance(purpose, dict) else purpose,
+            listed_at=float(data.get('listed_at') or 0),
+        )
+
+    def to_dict(self) -> Dict:
+        """
+        :return: Dict that from_api() turns back into the same Channel. Used for the saved channel list.
+        """
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Channel) and self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return f'Channel({self.id}, #{self.name})'
+
+
+def from_api(channels: Iterable[Dict], listed_at: float = None) -> List[Channel]:
+    """
+    :param channels: Channel objects from conversations.list, or dicts from Channel.to_dict().
+    :param listed_at: When conversations.list returned the channels. Defaults to the time saved in each dict.
+    :return: List of Channel
+    """
+    channels = [Channel.from_api(channel) for channel in channels]
+    if listed_at is not None:
+        for channel in channels:
+            channel.listed_at = listed_at
+
+    return channels
+
+
+def describe(channels: List[Channel], limit: int = DEBUG_DUMP_LIMIT, total: int = None) -> str:
+    """
+    Short description of a channel list for the log, no matter how many channels there are.
+
+    :param channels: Channels to describe, or the first few of them if total is given.
+    :param limit: Most channel names to include.
+    :param total: Number of channels in the whole list. Defaults to len(channels).
+    :return: str: Ex. "3 channel(s): general, random, dev"
+    """
+    if total is None:
+        total = len(channels)
+    names = channels[:limit]
+    more = f' and {total - len(names)} more' if total > len(names) else ''
+
+    return f'{total} channel(s): {", ".join(channel.name for channel in names)}{more}'
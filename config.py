@@ -1,9 +1,16 @@
 # -*- coding: utf-8 -*-
 
+import atexit
+import copy
+import json
 import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from os import environ
 from messages import *
 from datetime import datetime, timedelta
+from typing import Dict, Mapping
 
 optional_env_vars = {
     'DRY_RUN': True,  # Only archives channels when set to False
@@ -12,6 +19,46 @@ optional_env_vars = {
     'DEFAULT_NOTIFICATION_CHANNEL': 'general',  # "#" is optional
     'JOIN_CHANNELS': True,  # Can set to False if script was recently run to save time.
     'RESULTS_FILE': 'results.csv',
+    'RESULTS_EXPORT_FILE': 'results.zip',  # channels.csv and members.csv tables, compressed. Blank = don't write
+    'USER_CACHE_FILE': 'users.db',  # SQLite file used to cache the user directory
+    'USER_CACHE_TTL_HOURS': 24,  # Reload the user directory after this many hours. 0 = always reload
+    'WORKERS': 1,  # Channels evaluated at the same time. 1 = one at a time
+    'RATE_LIMIT_PERCENT': 90,  # Percent of each Slack rate limit tier to use
+    'RATE_LIMIT_RETRIES': 5,  # Times to retry a call that was rate limited anyway
+    'HTTP_POOL_SIZE': 10,  # Connections to Slack kept open for reuse
+    'INCREMENTAL': True,  # Skip history checks for channels recently proven active
+    'STATE_FILE': 'state.db',  # SQLite file channel state is kept in between runs
+    'STATE_MARGIN_DAYS': 7,  # Only skip if the last message was at least this far inside DAYS_INACTIVE
+    'CHANNEL_CACHE_FILE': 'channels.db',  # Saved copy of the channel list
+    'CHANNEL_CACHE_TTL_MINUTES': 60,  # Reuse the saved channel list for this long. 0 = always list again
+    'CHECKPOINT_FILE': 'checkpoint.db',  # SQLite file run progress is saved in for --resume
+    'NETWORK_RETRIES': 3,  # Times to retry a call after a connection error or timeout
+    'SLACK_API_URL': 'https://slack.com/api',  # Only changed for testing. See fake_slack.py
+    'METRICS_FILE': 'metrics.json',  # Per method API call stats. Blank = don't write
+    'METRICS_PROM_FILE': '',  # Same stats in the Prometheus text format. Blank = don't write
+    'RULES_FILE': '',  # Extra exemption rules. See rules.py for the format. Blank = none
+    'ARCHIVE_WORKERS': 4,  # Channels notified and archived at the same time
+    'ARCHIVE_RETRIES': 2,  # Times to retry an archive after a temporary Slack error
+    'HISTORY_PAGE_SIZE': 20,  # Messages fetched per conversations.history call
+    'DAEMON_FULL_SWEEP_HOUR': 2,  # Local hour daemon.py runs the nightly full sweep at
+    'DAEMON_INCREMENTAL_MINUTES': 60,  # Minutes between daemon.py incremental sweeps. 0 = none
+    'DAEMON_HOST': '127.0.0.1',  # Address the daemon.py health endpoint listens on
+    'DAEMON_PORT': 8089,  # Port the daemon.py health endpoint listens on. 0 = no endpoint
+    'ACTIVITY_INDEX_FILE': '',  # SQLite file events.py keeps channel activity in. Blank = don't use events
+    'EVENTS_FLUSH_SECONDS': 5,  # How often events.py writes the activity index to disk
+    'EVENTS_PORT': 0,  # Port daemon.py receives Slack events on. 0 = don't receive events
+    'SLACK_SIGNING_SECRET': '',  # Used to check events come from Slack. Blank = don't check
+    'INCLUDE_PRIVATE': False,  # Also check private channels the bot is a member of
+    'ARCHIVED_INDEX_DAYS': 90,  # Report channels archived this recently that were unarchived again
+    'PAGE_SIZE_MAX': 1000,  # Most items asked for per page when listing. Pages start at 200 and grow to this
+    'PAGE_SLOW_MS': 2000,  # Pages slower than this are made smaller again
+    'LOG_FILE': 'logs.log',
+    'LOG_LEVEL': 'INFO',  # DEBUG, INFO, WARNING, ERROR or CRITICAL
+    'LOG_FORMAT': 'text',  # "text" or "json" (one JSON object per line)
+    'LOG_MAX_MB': 50,  # LOG_FILE is rotated once it reaches this size. 0 = never rotate
+    'LOG_BACKUPS': 5,  # Rotated log files kept
+    'VERBOSE': False,  # Print a line for every API call
+    'LOOKUP_WORKERS': 4,  # users.info calls made at the same time for users missing from the directory
 }
 
 # https://api.slack.com/events/message
@@ -22,7 +69,7 @@ channel_join
 channel_leave
 '''
 
-# Channels with any of these strings in their topic are skipped
+# Channels with any of these strings in their topic or purpose are skipped
 # A list item is generated from this automatically
 ALLOWLIST_KEYWORDS_RAW = '''
 %noarchive
@@ -30,73 +77,206 @@ ALLOWLIST_KEYWORDS_RAW = '''
 
 # These channels are skipped
 # A list item is generated from this automatically
+# Glob patterns can be used too. Ex. proj-*
 EXEMPT_CHANNELS_RAW = '''
 general
 '''
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    filename='logs.log',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    format='%(asctime)s - %(levelname)s - %(message)s',
-)
 
+class JsonFormatter(logging.Formatter):
+    """
+    Formats each record as one JSON object per line.
+    Anything passed with extra={...} is included as well. Ex. logging.info('Archived.', extra={'channel': 'C123'})
+    """
+
+    # Attributes every LogRecord has. Anything else came from extra={...}
+    RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        data.update({key: value for key, value in vars(record).items() if key not in self.RECORD_FIELDS})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+
+        return json.dumps(data, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    """
+    Puts records on the queue with the message filled in but the traceback kept apart,
+    so JsonFormatter can still put it in its own field.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()  # Args could change before the listener gets to the record
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None  # Tracebacks keep every frame's locals alive
 
-def check_if_int(var: str) -> bool:
+        return record
+
+
+_listener = None  # Writes queued log records to LOG_FILE in a background thread. See setup_logging()
+_listener_lock = threading.Lock()
+
+
+def _stop_listener() -> None:
+    global _listener
+
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()  # Writes anything still queued
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
+    return None
+
+
+def setup_logging(config: 'Config' = None) -> None:
     """
-    Checks to see if the given string exists as an environmental variable.
-    If so, checks if the value of that variable is an int.
-    If not, tries to convert to an int and update optional_env_vars.
+    Sends log messages to LOG_FILE, at LOG_LEVEL and in LOG_FORMAT.
+    Records are put on a queue and written by a background thread, so threads making API calls don't wait on disk.
+    The file is rotated once it reaches LOG_MAX_MB.
+    Called by the scripts, not on import, so importing this module doesn't touch the filesystem.
+    Calling it again replaces the previous setup.
 
-    :param var: Name of the env var to check.
+    :param config: Settings to use. Defaults to the defaults in optional_env_vars.
+    :return: None
+    """
+    global _listener
+
+    settings = optional_env_vars if config is None else vars(config)
+    _stop_listener()
+
+    handler = RotatingFileHandler(
+        settings['LOG_FILE'],
+        maxBytes=settings['LOG_MAX_MB'] * 1024 * 1024,
+        backupCount=settings['LOG_BACKUPS'],
+        encoding='utf-8',
+    )
+    if settings['LOG_FORMAT'] == 'json':
+        handler.setFormatter(JsonFormatter(datefmt='%Y-%m-%dT%H:%M:%S'))
+    else:
+        handler.setFormatter(
+            logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+        )
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for old_handler in [h for h in root.handlers if isinstance(h, _QueueHandler)]:
+        root.removeHandler(old_handler)
+    root.addHandler(_QueueHandler(log_queue))
+    root.setLevel(settings['LOG_LEVEL'])
+
+    with _listener_lock:
+        _listener = QueueListener(log_queue, handler)
+        _listener.start()
+
+    logging.info(f'Starting new log\n{stars}')
+
+    return None
+
+
+atexit.register(_stop_listener)
+
+
+def check_if_int(values: Dict, var: str) -> bool:
+    """
+    Checks if the value of the given variable is an int.
+    If not, tries to convert to an int and update values.
+
+    :param values: Dict of variable name: value.
+    :param var: Name of the variable to check.
     :return: bool
         True if var value is an int or can be converted to int.
         False otherwise.
     """
-    if type(optional_env_vars[var]) == int:
+    if type(values[var]) == int:
         return True
 
-    val = optional_env_vars[var]
+    val = values[var]
     try:
-        optional_env_vars[var] = int(val)
+        values[var] = int(val)
         return True
     except ValueError:
         print(f'Issue converting {var} to an int. Current value: {val}')
         return False
 
 
-def check_if_bool(var: str) -> bool:
+def check_if_choice(values: Dict, var: str, choices: tuple) -> bool:
     """
-    Checks to see if the given string exists as an environmental variable.
-    If so, checks if the value of that variable is true or false.
-    If not, tries to convert to a bool and update optional_env_vars.
+    Checks if the value of the given variable is one of the given choices, ignoring case.
+    If so, updates values with the matching choice.
 
-    :param var: Name of the env var to check.
+    :param values: Dict of variable name: value.
+    :param var: Name of the variable to check.
+    :param choices: Allowed values.
+    :return: bool
+        True if var value is one of the choices.
+        False otherwise.
+    """
+    val = str(values[var])
+    for choice in choices:
+        if val.lower() == choice.lower():
+            values[var] = choice
+            return True
+
+    print(f"{var} must be one of: {', '.join(choices)}. Current value: {val}")
+    return False
+
+
+def check_if_bool(values: Dict, var: str) -> bool:
+    """
+    Checks if the value of the given variable is true or false.
+    If not, tries to convert to a bool and update values.
+
+    :param values: Dict of variable name: value.
+    :param var: Name of the variable to check.
     :return: bool
         True if var value is a bool or can be converted to a bool.
         False otherwise.
     """
-    if type(optional_env_vars[var]) == bool:
+    if type(values[var]) == bool:
         return True
 
-    val = optional_env_vars[var].lower()
-    try:
-        if val == 'true':
-            optional_env_vars[var] = True
-            return True
-        elif val == 'false':
-            optional_env_vars[var] = False
-            return True
-        else:
-            print(f'{var} must be True or False. Current value: {val}')
-            return False
-    except ValueError:
-        print(f'Issue converting {var} to a bool.')
-        print(f'Current value: {val}')
+    val = str(values[var]).lower()
+    if val == 'true':
+        values[var] = True
+        return True
+    elif val == 'false':
+        values[var] = False
+        return True
+    else:
+        print(f'{var} must be True or False. Current value: {val}')
         return False
 
 
-def check_vars() -> None:
+INT_VARS = (
+    'DAYS_INACTIVE', 'MIN_MEMBERS', 'USER_CACHE_TTL_HOURS', 'WORKERS', 'RATE_LIMIT_PERCENT',
+    'RATE_LIMIT_RETRIES', 'HTTP_POOL_SIZE', 'STATE_MARGIN_DAYS', 'CHANNEL_CACHE_TTL_MINUTES',
+    'NETWORK_RETRIES', 'ARCHIVE_WORKERS', 'ARCHIVE_RETRIES', 'HISTORY_PAGE_SIZE',
+    'DAEMON_FULL_SWEEP_HOUR', 'DAEMON_INCREMENTAL_MINUTES', 'DAEMON_PORT', 'EVENTS_FLUSH_SECONDS', 'EVENTS_PORT',
+    'ARCHIVED_INDEX_DAYS', 'PAGE_SIZE_MAX', 'PAGE_SLOW_MS', 'LOG_MAX_MB', 'LOG_BACKUPS',
+    'LOOKUP_WORKERS',
+)
+BOOL_VARS = ('JOIN_CHANNELS', 'DRY_RUN', 'INCREMENTAL', 'INCLUDE_PRIVATE', 'VERBOSE')
+CHOICE_VARS = {
+    'LOG_LEVEL': ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'),
+    'LOG_FORMAT': ('text', 'json'),
+}
+
+
+def check_vars(env: Mapping = None, **overrides) -> Dict:
     """
     Checks the following:
         - Is API_TOKEN set?
@@ -106,42 +286,146 @@ def check_vars() -> None:
         If they are, overrides the defaults.
 
         Checks to see if optional variables are of the correct type.
-        It not, raises an exception. (This part can likely be coded better.)
+        It not, raises an exception.
 
-    :return: None
+    :param env: Env vars to read. os.environ by default.
+    :param overrides: Values to use instead of the env vars. Ex. DRY_RUN=True
+    :return: Dict of variable name: value, including API_TOKEN.
     """
-    env_vars = [x for x in sorted(list(environ.keys())) if x in optional_env_vars.keys()]
-    sorted_env_vars = sorted(list(env_vars))
+    if env is None:
+        env = environ
 
-    if environ.get('API_TOKEN'):
-        print('API_TOKEN is set. Continuing...\n')
-    else:
+    values = dict(optional_env_vars)
+    values.update({var: env[var] for var in sorted(env.keys()) if var in optional_env_vars})
+    values.update(overrides)
+    values['API_TOKEN'] = values.get('API_TOKEN') or env.get('API_TOKEN')
+
+    if not values['API_TOKEN']:
         raise ValueError('API_TOKEN must be set.')
 
-    if env_vars:
-        for var in sorted_env_vars:
-            if var in optional_env_vars.keys():
-                optional_env_vars[var] = environ[var]
-
-    if not all([
-        check_if_int('DAYS_INACTIVE'),
-        check_if_int('MIN_MEMBERS'),
-        check_if_bool('JOIN_CHANNELS'),
-        check_if_bool('DRY_RUN'),
-    ]):
+    results = [check_if_int(values, var) for var in INT_VARS]
+    results += [check_if_bool(values, var) for var in BOOL_VARS]
+    results += [check_if_choice(values, var, choices) for var, choices in CHOICE_VARS.items()]
+    if not all(results):
         raise ValueError('Issue(s) with optional variables.')
 
-    return None
+    return values
+
+
+class Config:
+    """
+    Settings for a single run, read from env vars by load_config().
+    Attribute names are the same as the env var names. Ex. config.DRY_RUN
+
+    Dates that depend on DAYS_INACTIVE are worked out when the Config is created,
+    so a process that runs for days should create a new Config for each run.
+    """
+
+    def __init__(self, values: Dict, now: datetime = None):
+        """
+        :param values: Checked values from check_vars().
+        :param now: Time to work out TOO_OLD_DATE from. Defaults to the current time.
+        """
+        self.API_TOKEN = values['API_TOKEN']
+        self.DRY_RUN = values['DRY_RUN']
+        self.RESULTS_FILE = values['RESULTS_FILE']
+        self.RESULTS_EXPORT_FILE = values['RESULTS_EXPORT_FILE']
+        self.DAYS_INACTIVE = values['DAYS_INACTIVE']
+        self.DEFAULT_NOTIFICATION_CHANNEL = values['DEFAULT_NOTIFICATION_CHANNEL']
+        self.JOIN_CHANNELS = values['JOIN_CHANNELS']
+        self.MIN_MEMBERS = values['MIN_MEMBERS']
+        self.USER_CACHE_FILE = values['USER_CACHE_FILE']
+        self.USER_CACHE_TTL_HOURS = values['USER_CACHE_TTL_HOURS']
+        self.WORKERS = max(1, values['WORKERS'])
+        self.RATE_LIMIT_PERCENT = max(1, values['RATE_LIMIT_PERCENT'])
+        self.RATE_LIMIT_RETRIES = values['RATE_LIMIT_RETRIES']
+        self.INCREMENTAL = values['INCREMENTAL']
+        self.STATE_FILE = values['STATE_FILE']
+        self.STATE_MARGIN_DAYS = values['STATE_MARGIN_DAYS']
+        self.CHANNEL_CACHE_FILE = values['CHANNEL_CACHE_FILE']
+        self.CHANNEL_CACHE_TTL_MINUTES = values['CHANNEL_CACHE_TTL_MINUTES']
+        self.CHECKPOINT_FILE = values['CHECKPOINT_FILE']
+        self.NETWORK_RETRIES = values['NETWORK_RETRIES']
+        self.SLACK_API_URL = values['SLACK_API_URL'].rstrip('/')
+        self.METRICS_FILE = values['METRICS_FILE']
+        self.METRICS_PROM_FILE = values['METRICS_PROM_FILE']
+        self.RULES_FILE = values['RULES_FILE']
+        self.ARCHIVE_WORKERS = max(1, values['ARCHIVE_WORKERS'])
+        self.ARCHIVE_RETRIES = values['ARCHIVE_RETRIES']
+        self.HISTORY_PAGE_SIZE = min(max(1, values['HISTORY_PAGE_SIZE']), 999)
+        self.DAEMON_FULL_SWEEP_HOUR = values['DAEMON_FULL_SWEEP_HOUR'] % 24
+        self.DAEMON_INCREMENTAL_MINUTES = max(0, values['DAEMON_INCREMENTAL_MINUTES'])
+        self.DAEMON_HOST = values['DAEMON_HOST']
+        self.DAEMON_PORT = values['DAEMON_PORT']
+        self.ACTIVITY_INDEX_FILE = values['ACTIVITY_INDEX_FILE']
+        self.EVENTS_FLUSH_SECONDS = max(1, values['EVENTS_FLUSH_SECONDS'])
+        self.EVENTS_PORT = values['EVENTS_PORT']
+        self.SLACK_SIGNING_SECRET = values['SLACK_SIGNING_SECRET']
+        self.INCLUDE_PRIVATE = values['INCLUDE_PRIVATE']
+        self.ARCHIVED_INDEX_DAYS = max(1, values['ARCHIVED_INDEX_DAYS'])
+        self.PAGE_SIZE_MAX = min(max(1, values['PAGE_SIZE_MAX']), 1000)
+        self.PAGE_SLOW_MS = max(1, values['PAGE_SLOW_MS'])
+        self.LOG_FILE = values['LOG_FILE']
+        self.LOG_LEVEL = values['LOG_LEVEL']
+        self.LOG_FORMAT = values['LOG_FORMAT']
+        self.LOG_MAX_MB = max(0, values['LOG_MAX_MB'])
+        self.LOG_BACKUPS = max(0, values['LOG_BACKUPS'])
+        self.VERBOSE = values['VERBOSE']
+        self.LOOKUP_WORKERS = max(1, values['LOOKUP_WORKERS'])
+        self.HTTP_POOL_SIZE = max(1, values['HTTP_POOL_SIZE'], self.WORKERS, self.ARCHIVE_WORKERS)
+        self.EXEMPT_SUBTYPES_RAW = values.get('EXEMPT_SUBTYPES_RAW', EXEMPT_SUBTYPES_RAW)
+        self.ALLOWLIST_KEYWORDS_RAW = values.get('ALLOWLIST_KEYWORDS_RAW', ALLOWLIST_KEYWORDS_RAW)
+        self.EXEMPT_CHANNELS_RAW = values.get('EXEMPT_CHANNELS_RAW', EXEMPT_CHANNELS_RAW)
+
+        if now is None:
+            now = datetime.now()
+        self.TOO_OLD_DATE = (now - timedelta(days=self.DAYS_INACTIVE)).date()
+        # Messages at or after this epoch time were sent on or after TOO_OLD_DATE
+        self.TOO_OLD_TS = datetime.combine(self.TOO_OLD_DATE, datetime.min.time()).timestamp()
+        # Channels created at or after this epoch time were created after TOO_OLD_DATE
+        self.CREATED_CUTOFF = datetime.combine(self.TOO_OLD_DATE + timedelta(days=1), datetime.min.time()).timestamp()
+
+
+def load_config(env: Mapping = None, **overrides) -> Config:
+    """
+    Reads and checks the settings for a run. See check_vars().
+
+    :param env: Env vars to read. os.environ by default.
+    :param overrides: Values to use instead of the env vars. Ex. DRY_RUN=True
+    :return: Config
+    """
+    return Config(check_vars(env, **overrides))
+
+
+_config = None  # Used by every module. Created on first use by get_config()
+_config_lock = threading.Lock()
+
 
+def get_config() -> Config:
+    """
+    Returns the settings for the current run, reading them from the env vars on first use.
+
+    :return: Config
+    """
+    global _config
+
+    with _config_lock:
+        if _config is None:
+            _config = load_config()
+
+    return _config
+
+
+def set_config(config: Config) -> Config:
+    """
+    Makes the given settings the ones returned by get_config().
+
+    :param config: Config to use from now on.
+    :return: Config: The given config.
+    """
+    global _config
 
-logging.info(f'Starting new log\n{stars}')
-check_vars()
+    with _config_lock:
+        _config = config
 
-API_TOKEN = environ.get('API_TOKEN')
-DRY_RUN = optional_env_vars['DRY_RUN']
-RESULTS_FILE = optional_env_vars['RESULTS_FILE']
-DAYS_INACTIVE = optional_env_vars['DAYS_INACTIVE']
-DEFAULT_NOTIFICATION_CHANNEL = optional_env_vars['DEFAULT_NOTIFICATION_CHANNEL']
-JOIN_CHANNELS = optional_env_vars['JOIN_CHANNELS']
-MIN_MEMBERS = optional_env_vars['MIN_MEMBERS']
-TOO_OLD_DATE = (datetime.now() - timedelta(days=optional_env_vars['DAYS_INACTIVE'])).date()
+    return config
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the script as a long-lived process instead of once per cron job.
+The HTTP connection pool, user directory and saved channel list stay warm between sweeps.
+
+    python3 daemon.py
+
+- A full sweep runs every night at DAEMON_FULL_SWEEP_HOUR. It lists every channel again
+  and checks the history of every channel, ignoring what earlier sweeps found.
+- An incremental sweep runs every DAEMON_INCREMENTAL_MINUTES in between. It reuses the channel list saved
+  since the last full sweep, however old, and skips channels known to be active (see INCREMENTAL in config.py).
+  Until the first full sweep, or if CHANNEL_CACHE_TTL_MINUTES is 0, CHANNEL_CACHE_TTL_MINUTES applies as usual.
+  The admin report is only sent if an incremental sweep archived something.
+
+If EVENTS_PORT and ACTIVITY_INDEX_FILE are set, Slack message events are received on EVENTS_PORT
+and most channels are answered from them instead of conversations.history. See events.py.
+
+If DAEMON_PORT is set, a health endpoint listens on DAEMON_HOST:DAEMON_PORT:
+- /health: JSON with the state of the last sweep and when the next ones are due
+- /metrics: API call stats and sweep counts in the Prometheus text format
+
+Unlike main.py, the daemon does not ask before archiving when DRY_RUN is False.
+"""
+
+import argparse
+import json
+import logging
+import signal
+import threading
+import time
+import main
+from config import Config, load_config, set_config, setup_logging
+from datetime import datetime, timedelta
+from events import get_activity_index, start_receiver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from messages import stars
+from metrics import get_metrics
+from typing import Dict, Optional
+
+
+def next_full_sweep(now: datetime, hour: int) -> datetime:
+    """
+    :param now: Current local time.
+    :param hour: Hour of the day full sweeps run at.
+    :return: datetime: The next time a full sweep is due. Always after now.
+    """
+    due = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if due <= now:
+        due += timedelta(days=1)
+
+    return due
+
+
+class Daemon:
+    """
+    Runs full and incremental sweeps on a schedule until stopped.
+    Only one sweep runs at a time.
+    """
+
+    def __init__(self, config: Config):
+        """
+        :param config: Settings read when the daemon started. Each sweep reads the env vars again.
+        """
+        self.config = config
+        self.stopping = threading.Event()
+        self.started = time.time()
+        self.sweeps = 0
+        self.failures = 0
+        self.sweeps_by_kind = {'full': 0, 'incremental': 0}
+        self.last_durations = {}  # Kind: seconds the last sweep of that kind took
+        self.running = None  # "full" or "incremental" while a sweep is running
+        self.last_sweep = {}  # Kind, start, duration, summary and error of the last sweep
+        self.last_full = None  # When the last full sweep started. Incremental sweeps reuse listings newer than this.
+        self.next_full = next_full_sweep(datetime.now(), config.DAEMON_FULL_SWEEP_HOUR)
+        self.next_incremental = self._after_interval(datetime.now())
+        self._lock = threading.Lock()
+
+    def _after_interval(self, now: datetime) -> Optional[datetime]:
+        if not self.config.DAEMON_INCREMENTAL_MINUTES:
+            return None
+
+        return now + timedelta(minutes=self.config.DAEMON_INCREMENTAL_MINUTES)
+
+    def sweep(self, full: bool) -> Dict:
+        """
+        Runs a single sweep. Errors are logged and recorded instead of stopping the daemon.
+
+        :param full: True for a full sweep, False for an incremental one.
+        :return: Dict: What is shown as "last_sweep" on /health.
+        """
+        kind = 'full' if full else 'incremental'
+        start = time.time()
+        summary = None
+        error = ''
+
+        print(f'\n{stars}\nStarting {kind} sweep.')
+        logging.info(f'Starting {kind} sweep.\n{stars}')
+
+        with self._lock:
+            self.running = kind
+
+        # Each sweep reports its own API calls. The Prometheus counters keep counting. See metrics.py.
+        get_metrics().reset()
+
+        try:
+            # New config for each sweep so TOO_OLD_DATE moves forward with the date
+            max_age = None
+            if full:
+                config = load_config(INCREMENTAL=False)
+                self.last_full = start
+            else:
+                config = load_config(INCREMENTAL=True)
+                if self.last_full and config.CHANNEL_CACHE_TTL_MINUTES:
+                    # The listing made by the last full sweep is reused even if it is older than the TTL
+                    max_age = time.time() - self.last_full
+
+            summary = main.run(config, refresh=full, report=False, max_age=max_age)
+
+            if full or (summary['archived'] and not config.DRY_RUN):
+                main.send_admin_report()
+        except (Exception, SystemExit) as e:
+            # api_call() exits on errors it can't recover from. The next sweep tries again.
+            error = str(e) or type(e).__name__
+            print(f'{kind.capitalize()} sweep failed: {error}')
+            logging.exception(f'{kind.capitalize()} sweep failed.')
+
+        duration = time.time() - start
+        result = {
+            'kind': kind,
+            'started': datetime.fromtimestamp(start).isoformat(timespec='seconds'),
+            'duration': round(duration, 3),
+            'summary': summary,
+            'error': error,
+        }
+
+        with self._lock:
+            self.running = None
+            self.sweeps += 1
+            self.sweeps_by_kind[kind] += 1
+            self.failures += bool(error)
+            self.last_durations[kind] = round(duration, 3)
+            self.last_sweep = result
+
+        logging.info(f'{kind.capitalize()} sweep done in {duration:.1f} seconds.')
+
+        return result
+
+    def run_forever(self, full_first: bool = False) -> None:
+        """
+        Runs sweeps as they come due until stop() is called.
+
+        :param full_first: Set to True to run a full sweep straight away.
+        :return: None
+        """
+        if full_first:
+            self.sweep(full=True)
+            self.next_incremental = self._after_interval(datetime.now())
+
+        while not self.stopping.is_set():
+            now = datetime.now()
+
+            if now >= self.next_full:
+                self.sweep(full=True)
+                self.next_full = next_full_sweep(datetime.now(), self.config.DAEMON_FULL_SWEEP_HOUR)
+                self.next_incremental = self._after_interval(datetime.now())
+            elif self.next_incremental and now >= self.next_incremental:
+                self.sweep(full=False)
+                self.next_incremental = self._after_interval(datetime.now())
+            else:
+                due = min(x for x in (self.next_full, self.next_incremental) if x)
+                # Wake up at least once a minute in case the clock jumps
+                self.stopping.wait(min(60.0, (due - now).total_seconds()))
+
+        return None
+
+    def stop(self, *args) -> None:
+        """
+        Stops the daemon once any running sweep is done. Can be used as a signal handler.
+
+        :return: None
+        """
+        print('Stopping after the current sweep...')
+        logging.info('Daemon stopping.')
+        self.stopping.set()
+
+        return None
+
+    def health(self) -> Dict:
+        """
+        :return: Dict: What is shown on /health.
+        """
+        with self._lock:
+            return {
+                'status': 'failing' if self.last_sweep.get('error') else 'ok',
+                'uptime': round(time.time() - self.started, 3),
+                'dry_run': self.config.DRY_RUN,
+                'running': self.running,
+                'sweeps': self.sweeps,
+                'failed_sweeps': self.failures,
+                'last_sweep': self.last_sweep,
+                'next_full_sweep': self.next_full.isoformat(timespec='seconds'),
+                'next_incremental_sweep': (
+                    self.next_incremental.isoformat(timespec='seconds') if self.next_incremental else None
+                ),
+            }
+
+    def prometheus_text(self) -> str:
+        """
+        :return: str: Sweep counts and durations since the daemon started, in the Prometheus text format.
+        """
+        with self._lock:
+            lines = [
+                '# HELP slack_autoarchive_daemon_sweeps_total Sweeps run',
+                '# TYPE slack_autoarchive_daemon_sweeps_total counter',
+            ]
+            lines += [
+                f'slack_autoarchive_daemon_sweeps_total{{kind="{kind}"}} {count}'
+                for kind, count in self.sweeps_by_kind.items()
+            ]
+            lines += [
+                '# HELP slack_autoarchive_daemon_failed_sweeps_total Sweeps that failed',
+                '# TYPE slack_autoarchive_daemon_failed_sweeps_total counter',
+                f'slack_autoarchive_daemon_failed_sweeps_total {self.failures}',
+                '# HELP slack_autoarchive_daemon_last_sweep_seconds How long the last sweep of each kind took',
+                '# TYPE slack_autoarchive_daemon_last_sweep_seconds gauge',
+            ]
+            lines += [
+                f'slack_autoarchive_daemon_last_sweep_seconds{{kind="{kind}"}} {seconds}'
+                for kind, seconds in self.last_durations.items()
+            ]
+
+        return '\n'.join(lines) + '\n'
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    server: 'HealthServer'
+
+    def log_message(self, format, *args) -> None:
+        logging.debug(format, *args)
+
+    def do_GET(self) -> None:
+        if self.path == '/health':
+            body = json.dumps(self.server.daemon.health(), indent=2).encode()
+            content_type = 'application/json; charset=utf-8'
+        elif self.path == '/metrics':
+            body = (get_metrics().prometheus_text() + self.server.daemon.prometheus_text()).encode()
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class HealthServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, daemon: Daemon):
+        super().__init__(address, HealthHandler)
+        self.daemon = daemon
+
+
+def start_health_server(daemon: Daemon) -> Optional[HealthServer]:
+    """
+    Starts the health endpoint in a background thread.
+
+    :param daemon: The Daemon to report on.
+    :return: HealthServer, or None if DAEMON_PORT is 0.
+    """
+    if not daemon.config.DAEMON_PORT:
+        return None
+
+    server = HealthServer((daemon.config.DAEMON_HOST, daemon.config.DAEMON_PORT), daemon)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    print(f'Health endpoint: http://{daemon.config.DAEMON_HOST}:{server.server_address[1]}/health')
+    logging.info(f'Health endpoint listening on {daemon.config.DAEMON_HOST}:{server.server_address[1]}')
+
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archives inactive Slack channels on a schedule.')
+    parser.add_argument('--full-now', action='store_true', help='Run a full sweep straight away.')
+    args = parser.parse_args()
+
+    config = set_config(load_config())
+    setup_logging(config)
+
+    if config.DRY_RUN:
+        print('This is only a dry run. No channels will be archived.')
+    else:
+        print('This IS NOT a dry run. Channels will be archived.')
+
+    daemon = Daemon(config)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+
+    server = start_health_server(daemon)
+
+    receiver = None
+    if config.EVENTS_PORT and config.ACTIVITY_INDEX_FILE:
+        receiver = start_receiver(
+            get_activity_index(config.ACTIVITY_INDEX_FILE),
+            main.get_rules(),
+            config.DAEMON_HOST,
+            config.EVENTS_PORT,
+            config.SLACK_SIGNING_SECRET,
+            config.EVENTS_FLUSH_SECONDS,
+        )
+        print(f'Receiving events on http://{config.DAEMON_HOST}:{config.EVENTS_PORT}/slack/events')
+
+    try:
+        daemon.run_forever(full_first=args.full_now)
+    finally:
+        for running in (server, receiver):
+            if running is not None:
+                running.shutdown()
+                running.server_close()
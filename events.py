@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+"""
+Tracks channel activity from Slack Events API "message" events, so most channels don't need a
+conversations.history call. Events can be received over HTTP or replayed from a JSONL file:
+
+    python3 events.py --port 3000
+    python3 events.py --replay events.jsonl
+
+Point the app's Event Subscriptions Request URL at http://<host>:3000/slack/events
+and subscribe to the message.channels event. Set SLACK_SIGNING_SECRET to check that requests come from Slack.
+
+The latest activity per channel is kept in memory and written to ACTIVITY_INDEX_FILE in batches,
+at most every EVENTS_FLUSH_SECONDS, instead of once per event.
+main.py reads the same file. See is_channel_active().
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from config import get_config, load_config, set_config, setup_logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from rules import ExemptionRules, compile_rules
+from typing import Dict, Iterable, Optional
+
+FLUSH_BATCH = 5000  # Pending channels that cause a flush without waiting for the timer
+MAX_SIGNATURE_AGE = 5 * 60  # Seconds. Older requests could be replays. See Slack's request signing docs.
+HEARTBEAT_MISSES = 3  # Flush intervals without a heartbeat after which events may have been missed
+
+_indexes = {}  # One ActivityIndex per absolute file path
+_indexes_lock = threading.Lock()
+
+
+class ActivityIndex:
+    """
+    Latest message time per channel, as seen in events.
+    Reads come from memory. Writes are kept in memory and flushed to SQLite in a single transaction.
+
+    Also remembers when tracking started (tracking_since) and when the receiver was last running (last_heartbeat).
+    A channel with no events since then has had no activity since then, as long as no events were missed.
+    Events sent while the receiver was down are missed, so tracking starts again after a gap in the heartbeats.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: SQLite file to keep the index in.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._latest = {}  # Channel ID: latest message ts
+        self._pending = {}  # Channel ID: latest message ts, not written yet
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')  # main.py can read while events are written
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS activity (
+                    id TEXT PRIMARY KEY,
+                    last_ts REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            self._latest = dict(self._conn.execute('SELECT id, last_ts FROM activity').fetchall())
+
+            self._read_meta()
+
+    def _read_meta(self) -> None:
+        meta = dict(self._conn.execute('SELECT key, value FROM meta').fetchall())
+        self.tracking_since = float(meta['tracking_since']) if 'tracking_since' in meta else None
+        self.last_heartbeat = float(meta['heartbeat']) if 'heartbeat' in meta else None
+
+    def start_tracking(self, max_gap: float) -> None:
+        """
+        Records that events are being received from now on.
+        Tracking carries on from before only if the receiver was last running less than max_gap seconds ago.
+
+        :param max_gap: Seconds without a heartbeat after which events may have been missed.
+        :return: None
+        """
+        now = time.time()
+
+        with self._lock, self._conn:
+            if self.last_heartbeat is None or now - self.last_heartbeat > max_gap:
+                self.tracking_since = now
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('tracking_since', ?)",
+                    (str(self.tracking_since),)
+                )
+
+        self.heartbeat()
+
+        return None
+
+    def heartbeat(self) -> None:
+        """
+        Records that the receiver is running. Called by the receiver every flush interval.
+
+        :return: None
+        """
+        with self._lock, self._conn:
+            self.last_heartbeat = time.time()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('heartbeat', ?)", (str(self.last_heartbeat),)
+            )
+
+        return None
+
+    def tracked_since(self, max_gap: float) -> Optional[float]:
+        """
+        :param max_gap: Seconds without a heartbeat after which events may have been missed.
+        :return: When tracking started, or None if the receiver isn't running, so events may be being missed.
+        """
+        with self._lock:
+            if self.last_heartbeat is None or time.time() - self.last_heartbeat > max_gap:
+                return None
+
+            return self.tracking_since
+
+    def observe(self, channel_id: str, ts: float) -> bool:
+        """
+        Records a message in the given channel. Older messages than the one already recorded are ignored.
+
+        :param channel_id: Slack channel ID.
+        :param ts: Message ts.
+        :return: bool: True if this is the channel's latest message so far.
+        """
+        with self._lock:
+            if ts <= self._latest.get(channel_id, 0):
+                return False
+
+            self._latest[channel_id] = ts
+            self._pending[channel_id] = ts
+            pending = len(self._pending)
+
+        if pending >= FLUSH_BATCH:
+            self.flush()
+
+        return True
+
+    def get(self, channel_id: str) -> Optional[float]:
+        """
+        :param channel_id: Slack channel ID.
+        :return: ts of the channel's latest message seen in events, or None if there were none.
+        """
+        with self._lock:
+            return self._latest.get(channel_id)
+
+    def reload(self) -> None:
+        """
+        Picks up anything written by another process. Ex. events.py running next to main.py
+
+        :return: None
+        """
+        self.flush()
+
+        with self._lock:
+            rows = self._conn.execute('SELECT id, last_ts FROM activity').fetchall()
+            for channel_id, ts in rows:
+                if ts > self._latest.get(channel_id, 0):
+                    self._latest[channel_id] = ts
+
+            self._read_meta()
+
+        return None
+
+    def flush(self) -> int:
+        """
+        Writes every pending change in one transaction.
+
+        :return: int: Number of channels written.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            with self._conn:
+                self._conn.executemany(
+                    '''
+                    INSERT INTO activity (id, last_ts) VALUES (?, ?)
+                    ON CONFLICT (id) DO UPDATE SET last_ts = excluded.last_ts
+                    WHERE excluded.last_ts > activity.last_ts
+                    ''',
+                    pending.items()
+                )
+
+        logging.debug('Activity index: %s channel(s) written.', len(pending))
+
+        return len(pending)
+
+    def close(self) -> None:
+        """
+        Flushes and closes the underlying database connection.
+
+        :return: None
+        """
+        self.flush()
+
+        with self._lock:
+            self._conn.close()
+
+        return None
+
+
+def get_activity_index(path: str) -> ActivityIndex:
+    """
+    Returns the shared ActivityIndex for the given file, opening it on first use.
+
+    :param path: SQLite file to keep the index in.
+    :return: ActivityIndex
+    """
+    path = os.path.abspath(path)
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = ActivityIndex(path)
+
+    return _indexes[path]
+
+
+def handle_event(event: Dict, index: ActivityIndex, rules: ExemptionRules) -> bool:
+    """
+    Records a single event in the index if it is a message that counts as activity.
+
+    :param event: The "event" part of an Events API payload, or a whole event_callback payload.
+    :param index: Index to record in.
+    :param rules: Rules with the message subtypes to ignore.
+    :return: bool: True if the event was recorded.
+    """
+    if event.get('type') == 'event_callback':
+        event = event.get('event', {})
+
+    if event.get('type') != 'message' or not event.get('channel') or not event.get('ts'):
+        return False
+    if event.get('hidden'):
+        return False  # Edits and deletions. Not a new message.
+    if rules.is_exempt_subtype(event.get('subtype')):
+        return False
+
+    return index.observe(event['channel'], float(event['ts']))
+
+
+def replay(lines: Iterable[str], index: ActivityIndex, rules: ExemptionRules) -> int:
+    """
+    Records every event in a JSONL file. Each line is an event or an event_callback payload.
+
+    :param lines: Lines of the file.
+    :param index: Index to record in.
+    :param rules: Rules with the message subtypes to ignore.
+    :return: int: Number of events recorded.
+    """
+    recorded = 0
+
+    for line in lines:
+        line = line.strip()
+        if line:
+            recorded += handle_event(json.loads(line), index, rules)
+
+    index.flush()
+
+    return recorded
+
+
+def verify_signature(secret: str, timestamp: str, body: bytes, signature: str) -> bool:
+    """
+    Checks the X-Slack-Signature header of a request.
+    See https://api.slack.com/authentication/verifying-requests-from-slack
+
+    :param secret: The app's signing secret.
+    :param timestamp: X-Slack-Request-Timestamp header.
+    :param body: Raw request body.
+    :param signature: X-Slack-Signature header.
+    :return: bool: True if the request came from Slack.
+    """
+    try:
+        if abs(time.time() - int(timestamp)) > MAX_SIGNATURE_AGE:
+            return False
+    except (TypeError, ValueError):
+        return False
+
+    base = b'v0:' + timestamp.encode() + b':' + body
+    expected = 'v0=' + hmac.new(secret.encode(), base, hashlib.sha256).hexdigest()
+
+    return hmac.compare_digest(expected, signature or '')
+
+
+class EventHandler(BaseHTTPRequestHandler):
+    server: 'EventServer'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args) -> None:
+        pass  # One line per event would flood the log
+
+    def _send(self, status: int, body: bytes = b'', content_type: str = 'text/plain') -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        if self.path != '/slack/events':
+            return self._send(404)
+
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        if self.server.signing_secret and not verify_signature(
+                self.server.signing_secret,
+                self.headers.get('X-Slack-Request-Timestamp'),
+                body,
+                self.headers.get('X-Slack-Signature'),
+        ):
+            logging.warning('Rejected event with a bad signature.')
+            return self._send(401)
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return self._send(400)
+
+        if payload.get('type') == 'url_verification':
+            return self._send(200, json.dumps({'challenge': payload.get('challenge')}).encode(), 'application/json')
+
+        handle_event(payload, self.server.index, self.server.rules)
+
+        # Slack retries events that aren't acknowledged within 3 seconds
+        return self._send(200)
+
+
+class EventServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+            self,
+            address,
+            index: ActivityIndex,
+            rules: ExemptionRules,
+            signing_secret: str = '',
+            flush_seconds: float = 5.0,
+    ):
+        super().__init__(address, EventHandler)
+        self.index = index
+        self.rules = rules
+        self.signing_secret = signing_secret
+        self.flush_seconds = flush_seconds
+        self._stopped = threading.Event()
+
+    def flush_periodically(self) -> None:
+        while not self._stopped.wait(self.flush_seconds):
+            self.index.flush()
+            self.index.heartbeat()
+
+    def shutdown(self) -> None:
+        self._stopped.set()
+        super().shutdown()
+        self.index.flush()
+
+
+def start_receiver(
+        index: ActivityIndex,
+        rules: ExemptionRules,
+        host: str = '0.0.0.0',
+        port: int = 3000,
+        signing_secret: str = '',
+        flush_seconds: float = 5.0,
+) -> EventServer:
+    """
+    Starts the event receiver and a timer that flushes the index, both in background threads.
+
+    :param index: Index to record events in.
+    :param rules: Rules with the message subtypes to ignore.
+    :param host: Address to listen on.
+    :param port: Port to listen on. 0 picks a free port.
+    :param signing_secret: The app's signing secret. Blank = don't check signatures.
+    :param flush_seconds: Seconds between flushes of the index.
+    :return: EventServer: Call shutdown() on it when done.
+    """
+    index.start_tracking(flush_seconds * HEARTBEAT_MISSES)
+
+    server = EventServer((host, port), index, rules, signing_secret, flush_seconds)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    threading.Thread(target=server.flush_periodically, daemon=True).start()
+
+    return server
+
+
+def _get_rules() -> ExemptionRules:
+    config = get_config()
+
+    return compile_rules(
+        exempt_channels_raw=config.EXEMPT_CHANNELS_RAW,
+        keywords_raw=config.ALLOWLIST_KEYWORDS_RAW,
+        exempt_subtypes_raw=config.EXEMPT_SUBTYPES_RAW,
+        rules_file=config.RULES_FILE,
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tracks channel activity from Slack message events.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--replay', metavar='JSONL', help='Record the events in this file and exit.')
+    args = parser.parse_args()
+
+    config = set_config(load_config())
+    setup_logging(config)
+    if not config.ACTIVITY_INDEX_FILE:
+        raise ValueError('ACTIVITY_INDEX_FILE must be set.')
+
+    index = get_activity_index(config.ACTIVITY_INDEX_FILE)
+    rules = _get_rules()
+
+    if args.replay:
+        with open(args.replay, encoding='utf-8') as f:
+            print(f'{replay(f, index, rules)} event(s) recorded in {config.ACTIVITY_INDEX_FILE}')
+        index.close()
+    else:
+        receiver = start_receiver(
+            index, rules, args.host, args.port, config.SLACK_SIGNING_SECRET, config.EVENTS_FLUSH_SECONDS
+        )
+        print(f'Receiving events on http://{args.host}:{receiver.server_address[1]}/slack/events')
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            receiver.shutdown()
+            index.close()
@@ -0,0 +1,534 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Slack Web API, used for benchmarks and testing without a real workspace.
+Generates a synthetic workspace and serves the API methods this script uses.
+
+Run on its own:
+    python3 fake_slack.py --channels 1000 --users 5000 --port 8080
+Then point the script at it:
+    SLACK_API_URL=http://127.0.0.1:8080/api API_TOKEN=fake python3 main.py
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from rate_limiter import DEFAULT_TIER, METHOD_TIERS, TIER_LIMITS
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+DAY = 24 * 60 * 60
+
+
+class Workspace:
+    """
+    A synthetic Slack workspace.
+    Everything is generated from the seed, so the same arguments always give the same workspace.
+    """
+
+    def __init__(
+            self,
+            channels: int = 1000,
+            users: int = 5000,
+            members_per_channel: int = 20,
+            inactive_ratio: float = 0.3,
+            join_message_ratio: float = 0.1,
+            recent_ratio: float = 0.05,
+            exempt_topic_ratio: float = 0.02,
+            inactive_days: int = 180,
+            private_ratio: float = 0.0,
+            unlisted_users: int = 0,
+            seed: int = 0,
+    ):
+        """
+        :param channels: Number of channels to generate.
+        :param users: Number of users to generate.
+        :param members_per_channel: Average number of members in a channel.
+        :param inactive_ratio: Fraction of channels whose last real message is inactive_days old.
+        :param join_message_ratio: Fraction of channels whose latest message is a channel_join
+            that comes after the last real message.
+        :param recent_ratio: Fraction of channels created in the last week.
+        :param exempt_topic_ratio: Fraction of channels with "%noarchive" in the topic.
+        :param inactive_days: Age in days of the last message in inactive channels.
+        :param private_ratio: Fraction of channels that are private. The bot is a member of every private channel.
+        :param unlisted_users: Number of users left out of users.list, as if they joined after it was called.
+            They can still be looked up with users.info.
+        :param seed: Random seed.
+        """
+        self.now = time.time()
+        self.team_id = 'T00000001'
+        self.users = [
+            {
+                'id': f'U{i:08d}',
+                'name': f'user{i}',
+                'updated': int(self.now) - i,
+                'profile': {'real_name': f'User {i}'},
+            }
+            for i in range(users)
+        ]
+        self.listed_users = self.users[unlisted_users:]
+        self.channels = []
+        self.members = {}  # Channel ID: list of user IDs
+        self.history = {}  # Channel ID: list of messages, newest first
+        self.joined = set()
+        self.archived = set()
+        self.lock = threading.Lock()
+
+        rand = random.Random(seed)
+        for i in range(channels):
+            channel_id = f'C{i:08d}'
+
+            if rand.random() < recent_ratio:
+                created = self.now - rand.randint(0, 7) * DAY
+            else:
+                created = self.now - rand.randint(365, 3 * 365) * DAY
+
+            if rand.random() < inactive_ratio:
+                last_message = self.now - (inactive_days + rand.randint(0, 30)) * DAY
+            else:
+                last_message = self.now - rand.randint(0, 30) * DAY
+
+            messages = [
+                {'type': 'message', 'user': self.users[0]['id'] if users else '', 'text': 'hi',
+                 'ts': f'{last_message - n * DAY:.6f}'}
+                for n in range(5)
+            ]
+            if rand.random() < join_message_ratio:
+                messages.insert(0, {
+                    'type': 'message', 'subtype': 'channel_join', 'text': 'joined',
+                    'ts': f'{self.now - rand.randint(0, 5) * DAY:.6f}',
+                })
+            self.history[channel_id] = messages
+
+            count = min(users, max(0, int(rand.gauss(members_per_channel, members_per_channel / 3))))
+            self.members[channel_id] = [user['id'] for user in rand.sample(self.users, count)]
+
+            topic = '%noarchive' if rand.random() < exempt_topic_ratio else ''
+            is_private = i > 0 and private_ratio > 0 and rand.random() < private_ratio
+            if is_private:
+                self.joined.add(channel_id)
+            self.channels.append({
+                'id': channel_id,
+                'name': f'channel-{i}',
+                'is_channel': True,
+                'is_group': False,
+                'is_im': False,
+                'is_private': is_private,
+                'is_archived': False,
+                'is_general': i == 0,
+                'created': int(created),
+                'updated': int(created) * 1000,
+                'creator': self.users[0]['id'] if users else '',
+                'num_members': count,
+                'topic': {'value': topic, 'creator': '', 'last_set': 0},
+                'purpose': {'value': f'Purpose of channel {i}', 'creator': '', 'last_set': 0},
+                'previous_names': [],
+                'shared_team_ids': [self.team_id],
+            })
+
+        if self.channels:
+            self.channels[0]['name'] = 'general'
+
+        self.channel_index = {channel['id']: channel for channel in self.channels}
+        self.user_index = {user['id']: user for user in self.users}
+
+
+class ServerBucket:
+    """
+    Slack's side of a rate limit: a token bucket that rejects calls instead of waiting.
+    """
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute
+        self.capacity = max(1.0, per_minute / 6)  # Allows short bursts, like Slack does
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> float:
+        """
+        :return: float: 0 if the call is allowed. Otherwise, seconds until it would be.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) / self.interval)
+            self.updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+
+            return (1 - self.tokens) * self.interval
+
+
+class FakeSlackServer(ThreadingHTTPServer):
+    """
+    HTTP server that answers Slack API calls from a Workspace.
+    Keeps per method counts of calls and 429 responses in "stats".
+    """
+    daemon_threads = True
+
+    def __init__(
+            self,
+            address: Tuple[str, int],
+            workspace: Workspace,
+            rate_scale: float = 1.0,
+            latency_ms: float = 0.0,
+            jitter_ms: float = 0.0,
+    ):
+        """
+        :param address: (host, port) to listen on. Port 0 picks a free port.
+        :param workspace: The workspace to serve.
+        :param rate_scale: Multiplier for Slack's rate limits. 0 = no rate limits.
+        :param latency_ms: Delay added to every response.
+        :param jitter_ms: Random extra delay of up to this much.
+        """
+        super().__init__(address, FakeSlackHandler)
+        self.workspace = workspace
+        self.rate_scale = rate_scale
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.buckets = {}
+        self.stats = defaultdict(lambda: {'calls': 0, 'rate_limited': 0})
+        self.stats_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        """
+        :return: str: Base URL to use as SLACK_API_URL.
+        """
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/api'
+
+    def check_rate_limit(self, method: str) -> float:
+        """
+        :param method: Slack API method name.
+        :return: float: 0 if the call is allowed. Otherwise, seconds until it would be.
+        """
+        if not self.rate_scale:
+            return 0.0
+
+        with self.stats_lock:
+            if method not in self.buckets:
+                tier = METHOD_TIERS.get(method, DEFAULT_TIER)
+                self.buckets[method] = ServerBucket(TIER_LIMITS[tier] * self.rate_scale)
+            bucket = self.buckets[method]
+
+        return bucket.take()
+
+    def count(self, method: str, rate_limited: bool = False) -> None:
+        with self.stats_lock:
+            self.stats[method]['calls'] += 1
+            if rate_limited:
+                self.stats[method]['rate_limited'] += 1
+
+    def get_stats(self) -> Dict:
+        """
+        :return: Dict of method name: {"calls": int, "rate_limited": int}
+        """
+        with self.stats_lock:
+            return {method: dict(counts) for method, counts in self.stats.items()}
+
+    def reset_stats(self) -> None:
+        with self.stats_lock:
+            self.stats.clear()
+
+
+def _page(items: List, params: Dict, default_limit: int = 100) -> Tuple[List, str]:
+    """
+    Cursor pagination shared by the list methods.
+
+    :return: Tuple of (items on this page, next cursor or "")
+    """
+    limit = min(int(params.get('limit') or default_limit), 1000)
+    cursor = params.get('cursor') or ''
+    start = int(cursor.split(':')[1]) if cursor.startswith('next:') else 0
+    end = start + limit
+
+    return items[start:end], f'next:{end}' if end < len(items) else ''
+
+
+def _is_true(value: Optional[str]) -> bool:
+    return str(value).lower() in ('1', 'true')
+
+
+class FakeSlackHandler(BaseHTTPRequestHandler):
+    server: FakeSlackServer
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like slack.com
+    disable_nagle_algorithm = True  # Otherwise headers and body sent separately add ~40 ms per call
+
+    def log_message(self, format, *args) -> None:
+        pass  # Keeps benchmark output readable
+
+    def do_GET(self) -> None:
+        self._handle()
+
+    def do_POST(self) -> None:
+        self._handle()
+
+    def _params(self) -> Dict:
+        parsed = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        content_type = self.headers.get('Content-Type', '')
+
+        if body and content_type.startswith('application/json'):
+            params.update(json.loads(body))
+        elif body and content_type.startswith('application/x-www-form-urlencoded'):
+            params.update({key: values[-1] for key, values in parse_qs(body.decode()).items()})
+        elif body:
+            params['_body_bytes'] = len(body)  # files.upload. Contents are not needed.
+
+        return params
+
+    def _send(self, status: int, data: Dict, headers: Dict = None) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self) -> None:
+        path = urlparse(self.path).path
+        params = self._params()
+
+        if path == '/_stats':
+            return self._send(200, self.server.get_stats())
+
+        method = path.rsplit('/', 1)[-1]
+
+        wait = self.server.check_rate_limit(method)
+        if wait:
+            self.server.count(method, rate_limited=True)
+            return self._send(429, {'ok': False, 'error': 'ratelimited'}, {'Retry-After': str(math.ceil(wait))})
+
+        self.server.count(method)
+
+        if self.server.latency_ms or self.server.jitter_ms:
+            time.sleep((self.server.latency_ms + random.random() * self.server.jitter_ms) / 1000)
+
+        handler = getattr(self, 'api_' + method.replace('.', '_'), None)
+        if handler is None:
+            return self._send(200, {'ok': False, 'error': 'unknown_method'})
+
+        if not self.headers.get('Authorization') and not params.get('token'):
+            return self._send(200, {'ok': False, 'error': 'not_authed'})
+
+        with self.server.workspace.lock:
+            data = handler(self.server.workspace, params)
+
+        self._send(200, data)
+
+    @staticmethod
+    def _channel(workspace: Workspace, params: Dict) -> Optional[Dict]:
+        channel = params.get('channel', '')
+        if channel in workspace.channel_index:
+            return workspace.channel_index[channel]
+
+        name = channel.lstrip('#')
+        for item in workspace.channels:
+            if item['name'] == name:
+                return item
+
+        return None
+
+    @staticmethod
+    def _view(workspace: Workspace, channel: Dict) -> Dict:
+        """
+        :return: Channel object as seen by the bot.
+        """
+        return dict(
+            channel,
+            is_member=channel['id'] in workspace.joined,
+            is_archived=channel['id'] in workspace.archived,
+        )
+
+    def api_auth_test(self, workspace: Workspace, params: Dict) -> Dict:
+        return {'ok': True, 'team_id': workspace.team_id, 'user_id': 'UBOT', 'team': 'Fake Workspace'}
+
+    def api_conversations_list(self, workspace: Workspace, params: Dict) -> Dict:
+        types = (params.get('types') or 'public_channel').split(',')
+        channels = [
+            channel for channel in workspace.channels
+            if ('private_channel' if channel['is_private'] else 'public_channel') in types
+            and not (_is_true(params.get('exclude_archived')) and channel['id'] in workspace.archived)
+        ]
+        page, cursor = _page(channels, params)
+
+        return {
+            'ok': True,
+            'channels': [self._view(workspace, channel) for channel in page],
+            'response_metadata': {'next_cursor': cursor},
+        }
+
+    def api_conversations_info(self, workspace: Workspace, params: Dict) -> Dict:
+        channel = self._channel(workspace, params)
+        if channel is None:
+            return {'ok': False, 'error': 'channel_not_found'}
+
+        return {'ok': True, 'channel': self._view(workspace, channel)}
+
+    def api_conversations_history(self, workspace: Workspace, params: Dict) -> Dict:
+        channel = self._channel(workspace, params)
+        if channel is None:
+            return {'ok': False, 'error': 'channel_not_found'}
+        if channel['id'] not in workspace.joined:
+            return {'ok': False, 'error': 'not_in_channel'}
+
+        oldest = float(params.get('oldest') or 0)
+        latest = float(params.get('latest') or 'inf')
+        messages = [
+            message for message in workspace.history[channel['id']]
+            if oldest < float(message['ts']) < latest
+        ]
+        page, cursor = _page(messages, params)
+
+        return {
+            'ok': True,
+            'messages': page,
+            'has_more': bool(cursor),
+            'response_metadata': {'next_cursor': cursor},
+        }
+
+    def api_conversations_members(self, workspace: Workspace, params: Dict) -> Dict:
+        channel = self._channel(workspace, params)
+        if channel is None:
+            return {'ok': False, 'error': 'channel_not_found'}
+
+        page, cursor = _page(workspace.members[channel['id']], params)
+
+        return {'ok': True, 'members': page, 'response_metadata': {'next_cursor': cursor}}
+
+    def api_conversations_join(self, workspace: Workspace, params: Dict) -> Dict:
+        channel = self._channel(workspace, params)
+        if channel is None:
+            return {'ok': False, 'error': 'channel_not_found'}
+        if channel['id'] in workspace.archived:
+            return {'ok': False, 'error': 'is_archived'}
+
+        data = {'ok': True, 'channel': self._view(workspace, channel)}
+        if channel['id'] in workspace.joined:
+            data['warning'] = 'already_in_channel'
+        else:
+            # Joining posts a channel_join message, like it does in Slack
+            workspace.joined.add(channel['id'])
+            workspace.history[channel['id']].insert(0, {
+                'type': 'message', 'subtype': 'channel_join', 'user': 'UBOT', 'text': 'joined',
+                'ts': f'{time.time():.6f}',
+            })
+
+        return data
+
+    def api_conversations_archive(self, workspace: Workspace, params: Dict) -> Dict:
+        channel = self._channel(workspace, params)
+        if channel is None:
+            return {'ok': False, 'error': 'channel_not_found'}
+        if channel['id'] in workspace.archived:
+            return {'ok': False, 'error': 'already_archived'}
+
+        workspace.archived.add(channel['id'])
+
+        return {'ok': True}
+
+    def api_conversations_unarchive(self, workspace: Workspace, params: Dict) -> Dict:
+        channel = self._channel(workspace, params)
+        if channel is None:
+            return {'ok': False, 'error': 'channel_not_found'}
+        if channel['id'] not in workspace.archived:
+            return {'ok': False, 'error': 'not_archived'}
+
+        workspace.archived.discard(channel['id'])
+
+        return {'ok': True}
+
+    def api_users_info(self, workspace: Workspace, params: Dict) -> Dict:
+        user = workspace.user_index.get(params.get('user', ''))
+        if user is None:
+            return {'ok': False, 'error': 'user_not_found'}
+
+        return {'ok': True, 'user': user}
+
+    def api_users_list(self, workspace: Workspace, params: Dict) -> Dict:
+        page, cursor = _page(workspace.listed_users, params)
+
+        return {'ok': True, 'members': page, 'response_metadata': {'next_cursor': cursor}}
+
+    def api_chat_postMessage(self, workspace: Workspace, params: Dict) -> Dict:
+        channel = self._channel(workspace, params)
+        if channel is None:
+            return {'ok': False, 'error': 'channel_not_found'}
+
+        return {'ok': True, 'channel': channel['id'], 'ts': f'{time.time():.6f}'}
+
+    def api_files_upload(self, workspace: Workspace, params: Dict) -> Dict:
+        return {'ok': True, 'file': {'id': 'F00000001', 'size': params.get('_body_bytes', 0)}}
+
+
+def start_server(
+        workspace: Workspace,
+        port: int = 0,
+        rate_scale: float = 1.0,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+) -> FakeSlackServer:
+    """
+    Starts a FakeSlackServer in a background thread.
+
+    :param workspace: The workspace to serve.
+    :param port: Port to listen on. 0 picks a free port.
+    :param rate_scale: Multiplier for Slack's rate limits. 0 = no rate limits.
+    :param latency_ms: Delay added to every response.
+    :param jitter_ms: Random extra delay of up to this much.
+    :return: FakeSlackServer: Call shutdown() on it when done.
+    """
+    server = FakeSlackServer(('127.0.0.1', port), workspace, rate_scale, latency_ms, jitter_ms)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs a fake Slack API with a synthetic workspace.')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--channels', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--members-per-channel', type=int, default=20)
+    parser.add_argument('--inactive-ratio', type=float, default=0.3)
+    parser.add_argument('--inactive-days', type=int, default=180)
+    parser.add_argument('--rate-scale', type=float, default=1.0, help='Multiplier for rate limits. 0 = none.')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    fake = start_server(
+        Workspace(
+            channels=args.channels,
+            users=args.users,
+            members_per_channel=args.members_per_channel,
+            inactive_ratio=args.inactive_ratio,
+            inactive_days=args.inactive_days,
+            seed=args.seed,
+        ),
+        port=args.port,
+        rate_scale=args.rate_scale,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+    )
+    print(f'Fake Slack API running at: {fake.url}')
+    print('Press Ctrl+C to stop.')
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        fake.shutdown()
@@ -1,12 +1,153 @@
 # -*- coding: utf-8 -*-
 
-from config import *
+from channels import DEBUG_DUMP_LIMIT, Channel, describe as describe_channels, from_api as channel_list_from_api
+from config import Config, get_config, load_config, set_config, setup_logging
+from events import HEARTBEAT_MISSES, get_activity_index
 from messages import *
-import csv
+import argparse
+import itertools
+import json
+import logging
+import os
+from cache import (
+    UserCache, get_archived_index, get_channel_cache, get_checkpoint, get_state_store, get_user_cache, get_user_name
+)
+from metrics import get_metrics
+from pagination import get_page_sizer, prefetch_pages
+from rate_limiter import get_rate_limiter
+from results import ResultsWriter
+from rules import ExemptionRules, compile_rules
 import sys
 import time
+import threading
+import queue
 import requests
-from typing import Dict
+from collections import deque
+from datetime import datetime, timedelta
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+_directory_lock = threading.Lock()  # Stops worker threads loading the user directory at the same time
+_joined = set()  # IDs of channels joined by this process. Saved channel lists don't know about these.
+LIST_PAGES_AHEAD = 4  # Pages of a channel type listed before the caller gets to them. See list_pages().
+PREPARE_BATCH_SIZE = 1000  # Channels checked and joined at a time before they are evaluated. See prepare_channels().
+# https://api.slack.com/methods/conversations.archive
+# Errors that mean a channel can't be archived. These are reported instead of ending the run.
+ARCHIVE_ERRORS = (
+    'already_archived', 'cant_archive_general', 'cant_archive_required', 'channel_not_found',
+    'method_not_supported_for_channel_type', 'not_in_channel', 'restricted_action',
+)
+# Errors that may go away if the call is made again
+RETRYABLE_ERRORS = ('internal_error', 'fatal_error', 'request_timeout', 'service_unavailable')
+# Errors that stop a channel from being notified. The channel is still archived.
+NOTIFY_ERRORS = ('channel_not_found', 'is_archived', 'not_in_channel', 'restricted_action') + RETRYABLE_ERRORS
+
+_rules = None  # Compiled exemption rules. Created on first use by get_rules()
+_rules_config = None  # Config _rules were compiled from
+_rules_lock = threading.Lock()
+_session = None  # Shared by every api_call. Created on first use by get_session()
+_session_key = None  # Token and pool size _session was created with
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the HTTP session used for every API call, creating it on first use.
+    Connections to Slack are kept alive and reused instead of opening a new one per call.
+    Up to HTTP_POOL_SIZE connections are kept open so worker threads don't wait on each other.
+    A new session is only created if the token or pool size changes between runs.
+
+    :return: requests.Session
+    """
+    global _session, _session_key
+
+    config = get_config()
+    key = (config.API_TOKEN, config.HTTP_POOL_SIZE)
+
+    with _session_lock:
+        if _session is None or _session_key != key:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1,  # Only one host: slack.com
+                pool_maxsize=config.HTTP_POOL_SIZE,
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers['Authorization'] = 'Bearer ' + config.API_TOKEN
+            if _session is not None:
+                _session.close()
+            _session = session
+            _session_key = key
+
+    return _session
+
+
+def get_connection_stats() -> Dict:
+    """
+    Returns how many connections were opened and how many requests were made over them.
+    A healthy run makes many requests per connection.
+
+    :return: Dict with "connections" and "requests" counts.
+    """
+    stats = {'connections': 0, 'requests': 0}
+
+    if _session is None:
+        return stats
+
+    adapters = {id(adapter): adapter for adapter in _session.adapters.values()}  # Same adapter is mounted twice
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                stats['connections'] += pool.num_connections
+                stats['requests'] += pool.num_requests
+
+    return stats
+
+
+def report_connection_stats() -> None:
+    """
+    Prints and logs the connection reuse stats from get_connection_stats().
+
+    :return: None
+    """
+    stats = get_connection_stats()
+    msg = f"HTTP connections opened: {stats['connections']}. Requests made: {stats['requests']}."
+
+    print(msg)
+    logging.info(msg)
+
+    get_metrics().set('http_connections_opened', stats['connections'])
+    get_metrics().set('http_requests_made', stats['requests'])
+
+    return None
+
+
+def report_metrics() -> None:
+    """
+    Prints and logs a summary of every API call made during the run.
+    Writes the same data to METRICS_FILE (JSON) and METRICS_PROM_FILE (Prometheus text format) if set.
+
+    :return: None
+    """
+    config = get_config()
+    metrics = get_metrics()
+    table = metrics.summary_table()
+
+    print(f'\nAPI call summary:\n{table}\n')
+    logging.info(f'API call summary:\n{table}')
+
+    for path, write in ((config.METRICS_FILE, metrics.write_json), (config.METRICS_PROM_FILE, metrics.write_prometheus)):
+        if not path:
+            continue
+        try:
+            write(path)
+        except OSError as e:
+            print(f'Error writing: {path}')
+            logging.warning(f'Error writing metrics to {path}: {e}')
+
+    return None
 
 
 def api_call(
@@ -17,12 +158,16 @@ def api_call(
     charset: str = 'utf-8',
     method: str = 'GET',
     full_response: bool = False,
-    files: Dict = None
+    files: Dict = None,
+    allowed_errors: tuple = (),
+    call_stats: Dict = None
 ) -> requests.models.Response:
     """
     Makes a Slack API call to the given endpoint.
     Returns a json object of the results if successful.
-    Returns [] otherwise
+    Calls are paced to stay under the method's rate limit tier.
+    If the limit is reached anyway, the call is retried up to RATE_LIMIT_RETRIES times.
+    Connection errors and timeouts are retried up to NETWORK_RETRIES times.
 
     :param content_type: Specifies the content type to send with header.
     :param endpoint: The API endpoint to call.
@@ -32,18 +177,22 @@ def api_call(
     :param method: Type of call to make. Ex. "Get", "POST", etc.
     :param full_response: If true returns full response. If false, returns response.json()
     :param files: Files object to upload
+    :param allowed_errors: Slack errors to return to the caller instead of exiting. Ex. ("already_archived",)
+    :param call_stats: Dict to fill in with the "latency" and "bytes" of the last request
+        and how many times the call was "rate_limited". Used by api_pages().
 
     :return: list data: JSON data resulting from the call.
     """
-    base_url = 'https://slack.com/api'
+    config = get_config()
+    base_url = config.SLACK_API_URL
 
     if endpoint[0] == '/':
         url = base_url + endpoint
     else:
         url = base_url + '/' + endpoint
 
-    print(f'Making API call to: {url}...')
-    logging.debug(f'API call: {url}...')
+    method_name = url.rsplit('/', 1)[-1]  # Ex. "conversations.list"
+    limiter = get_rate_limiter(config.RATE_LIMIT_PERCENT / 100)
 
     if charset:
         headers = {
@@ -54,34 +203,85 @@ def api_call(
             'Content-type': f'{content_type}',
         }
 
-    headers['Authorization'] = 'Bearer ' + API_TOKEN
+    session = get_session()  # Sends the Authorization header with every call
+    metrics = get_metrics()
+    network_errors = 0
+
+    for attempt in range(config.RATE_LIMIT_RETRIES + config.NETWORK_RETRIES + 1):
+        metrics.record_wait(method_name, pacing_wait=limiter.acquire(method_name))
+
+        if config.VERBOSE:
+            print(f'Making API call to: {url}...')
+        logging.debug('API call: %s...', url)  # Not formatted unless LOG_LEVEL is DEBUG
+
+        start = time.perf_counter()
+        try:
+            if json_data:
+                response = session.request(method, url, headers=headers, json=json_data)
+            elif files:
+                for file in files.values():
+                    file[1].seek(0)  # Rewind in case this is a retry
+                response = session.request(method, url, data=payload, files=files)
+            else:
+                response = session.request(method, url, headers=headers, params=payload)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            network_errors += 1
+            if network_errors <= config.NETWORK_RETRIES:
+                backoff = 2 ** network_errors
+                print(f'Network error. Retrying after {backoff} seconds...')
+                logging.warning(f'Network error calling {method_name}: {e}. Retrying after {backoff} seconds.')
+                time.sleep(backoff)
+                continue
 
-    if json_data:
-        response = requests.request(method, url, headers=headers, json=json_data)
-    elif files:
-        response = requests.request(method, url, data=payload, files=files)
-    else:
-        response = requests.request(method, url, headers=headers, params=payload)
+            logging.critical(f'Error: {e}')
+            logging.info(log_end)
+            print(api_error)
+            raise SystemExit(e)
+        except requests.exceptions.RequestException as e:
+            logging.critical(f'Error: {e}')
+            logging.info(log_end)
+            print(api_error)
+            raise SystemExit(e)
+
+        body = response.request.body
+        latency = time.perf_counter() - start
+        metrics.record_call(
+            method_name,
+            latency=latency,
+            bytes_sent=len(body) if isinstance(body, (bytes, str)) else 0,
+            bytes_received=len(response.content),
+            rate_limited=response.status_code == 429,
+        )
+
+        if call_stats is not None:
+            call_stats['latency'] = latency
+            call_stats['bytes'] = len(response.content)
+            call_stats['rate_limited'] = call_stats.get('rate_limited', 0) + (response.status_code == 429)
 
-    try:
         if response.status_code == 429:  # Rate limit reached
-            retry_after = int(response.headers.get('retry-after', '0'))
+            retry_after = int(response.headers.get('retry-after', '1'))
+            metrics.record_wait(method_name, retry_sleep=retry_after)
 
             print('Rate limit reached.')
             print(f'Retrying after {retry_after} seconds...')
-            logging.warning(f'Rate limit reached. Retry time: {retry_after}\n')
+            logging.warning(f'Rate limit reached for {method_name}. Retry time: {retry_after}\n')
 
-            time.sleep(retry_after)
-            print('Back to work...')
+            # Every thread calling this method waits, not just this one
+            limiter.throttled(method_name, retry_after)
+            continue
         elif response.status_code == 200:
             data = response.json()
 
             if data['ok']:
-                print('Call successful.')
-                logging.debug(response)
+                if config.VERBOSE:
+                    print('Call successful.')
+                logging.debug('%s: %s', method_name, response)
                 if full_response:
                     return response
-                return response.json()
+                return data
+            elif data.get('error') in allowed_errors:
+                logging.warning(f"{method_name} returned: {data['error']}")
+                return data
             else:
                 print(api_error)
                 logging.critical(f'Error: {response.content}')
@@ -93,11 +293,11 @@ def api_call(
             logging.critical(response)
             logging.critical(log_end)
             sys.exit(1)
-    except requests.exceptions.RequestException as e:
-        logging.critical(f'Error: {e}')
-        logging.info(log_end)
-        print(api_error)
-        raise SystemExit(e)
+
+    print(api_error)
+    logging.critical(f'Could not call {method_name} after {attempt + 1} attempts.')
+    logging.critical(log_end)
+    sys.exit(1)
 
 
 def test_call() -> bool:
@@ -115,232 +315,776 @@ def test_call() -> bool:
     return False
 
 
-def join_channels(channels: list) -> None:
+def api_pages(endpoint: str, payload: Dict, cursor: str = '') -> Iterator[Tuple[Dict, str]]:
+    """
+    Pages through a Slack method that uses cursor pagination.
+    The page size starts at 200 and is raised toward PAGE_SIZE_MAX while pages come back fast and un-throttled.
+    It is lowered again after a 429 or a page slower than PAGE_SLOW_MS. See pagination.py.
+    The next page is requested while the caller works on the current one.
+
+    :param endpoint: The API endpoint to call. Ex. "conversations.list"
+    :param payload: Parameters to send with every page. "cursor" and "limit" are added.
+    :param cursor: Cursor to start from. Empty string = the first page.
+    :return: Iterator of (response, cursor for the next page or '' if done)
+    """
+    config = get_config()
+    sizer = get_page_sizer(endpoint, config.PAGE_SIZE_MAX, config.PAGE_SLOW_MS / 1000)
+    metrics = get_metrics()
+    name = endpoint.replace('.', '_')  # Ex. "conversations_list_pages"
+
+    def fetch(page_cursor: str) -> Tuple[Dict, str]:
+        stats = {}
+        response = api_call(
+            endpoint,
+            content_type='application/x-www-form-urlencoded',
+            payload={**payload, 'cursor': page_cursor or None, 'limit': sizer.size},
+            call_stats=stats,
+        )
+        size = sizer.record(stats['latency'], stats['rate_limited'] > 0)
+
+        metrics.add(f'{name}_pages')
+        metrics.add(f'{name}_page_bytes', stats['bytes'])
+        metrics.set(f'{name}_page_size', size)
+
+        return response, response['response_metadata'].get('next_cursor') or ''
+
+    return prefetch_pages(fetch, cursor)
+
+
+def plan_joins(channels: List[Channel]) -> List[Channel]:
+    """
+    Returns the channels that need to be joined before their history can be read.
+    Uses only the data already in the channels and the saved channel state, no API calls.
+    Skips channels that are:
+    - Not a channel (DM, group, etc.) or already archived
+    - Private. The bot can only see private channels it is already in, and can't join them.
+    - Already joined ("is_member"), or joined earlier by this process or before an interrupted run stopped
+    - Exempt from being archived
+    - Known to be active from a previous run (when INCREMENTAL is set)
+    - Already decided before an interrupted run stopped
+
+    :param channels: List of Channel
+    :return: list: Channels to join.
+    """
+    config = get_config()
+    checkpoint = get_checkpoint(config.CHECKPOINT_FILE)
+    to_join = []
+
+    for channel in channels:
+        if not channel.is_channel or channel.is_archived or channel.is_private:
+            continue
+        if channel.is_member or channel.id in _joined or checkpoint.was_joined(channel.id):
+            continue
+        if get_exempt_reason(channel):
+            continue
+        if is_known_active(channel.id, channel.updated):
+            continue
+        if checkpoint.get_decision(channel.id)[0]:
+            continue
+
+        to_join.append(channel)
+
+    return to_join
+
+
+def join_channel(channel: Channel) -> None:
+    """
+    Joins the specified channel. Channel must be public.
+
+    :param channel: Channel
+    :return: None
+    """
+    endpoint = 'conversations.join'
+    channel_id = channel.id
+    channel_name = channel.name
+
+    print(f'Attempting to join: {channel_name}...')
+    logging.debug('Attempting to join: %s...', channel_name)
+
+    response = api_call(
+        method='POST', endpoint=endpoint,
+        json_data={"channel": channel_id}
+    )
+    if response.get('warning'):
+        warnings = response['warning'].split(',')
+        if 'already_in_channel' in warnings:
+            print(f'Already a member of: {channel_name}\n')
+            logging.debug('Already a member of: %s\n', channel_name)
+        else:
+            print(f'Warning(s): {warnings}')
+            logging.warning(f'Warning(s): {warnings}')
+    else:
+        print(f'Successfully joined: {channel_name}')
+        logging.debug('Successfully joined: %s', channel_name)
+
+    _joined.add(channel_id)
+    get_checkpoint(get_config().CHECKPOINT_FILE).save_joined(channel_id)
+
+    return None
+
+
+def join_channels(channels: List[Channel]) -> None:
     """
     Joins the specified channels. Channels must be public.
+    Only channels picked by plan_joins() are joined, up to WORKERS at a time.
 
-    :param channels: List of channel objects
+    :param channels: List of Channel
     :return: None
     """
-    if not JOIN_CHANNELS:  # Set in config.py
+    config = get_config()
+    if not config.JOIN_CHANNELS:  # Set in config.py
         return None
 
-    endpoint = 'conversations.join'
-    for channel in channels:
-        is_channel = channel['is_channel']  # As opposed to a DM, group, etc.
-        channel_name = channel['name']
+    to_join = plan_joins(channels)
+    avoided = len(channels) - len(to_join)
 
-        if is_channel:
-            channel_id = channel['id']
-            print(f'Attempting to join: {channel_name}...')
-            logging.debug(f'Attempting to join: {channel_name}...')
+    get_metrics().add('join_calls_avoided', avoided)
+    print(f'Joining {len(to_join)} channel(s). Join calls avoided: {avoided}\n')
+    logging.info(f'Joining {len(to_join)} of {len(channels)} channel(s). Join calls avoided: {avoided}')
 
-            response = api_call(
-                method='POST', endpoint=endpoint,
-                json_data={"channel": channel_id}
-            )
-            if response.get('warning'):
-                warnings = response['warning'].split(',')
-                if 'already_in_channel' in warnings:
-                    print(f'Already a member of: {channel_name}\n')
-                    logging.debug(f'Already a member of: {channel_name}\n')
-                else:
-                    print(f'Warning(s): {warnings}')
-                    logging.warning(f'Warning(s): {warnings}')
-            else:
-                print(f'Successfully joined: {channel_name}')
-                logging.debug(f'Successfully joined: {channel_name}')
-        else:
-            print(f'Skipping joining: {channel_name}')
-            logging.debug(f'Skipping joining: {channel_name}')
+    if config.WORKERS > 1:
+        with ThreadPoolExecutor(max_workers=config.WORKERS) as executor:
+            list(executor.map(join_channel, to_join))
+    else:
+        for channel in to_join:
+            join_channel(channel)
 
     return None
 
 
-def get_channels(
-        include_private: bool = False,
+def list_pages(
+        cursors: Dict[str, str],
         exclude_archived: bool = True
-) -> list:
+) -> Iterator[Tuple[str, List[Dict], str]]:
+    """
+    Pages through conversations.list for each channel type at the same time, one thread per type.
+    Pages are yielded one type at a time in the order of cursors, so the channels always come out in the same order.
+    The other types are listed in the background meanwhile, up to LIST_PAGES_AHEAD pages ahead.
+    The threads stop if the caller stops reading early.
+
+    :param cursors: Channel type: cursor to start from. Empty string = the first page.
+    :param exclude_archived: Set to False if archived channel should be included
+    :return: Iterator of (channel type, channel objects on the page, cursor for the next page or '' if done)
     """
-    Gets a list of all channels in the org.
+    def pages(types: str, cursor: str) -> Iterator[Tuple[str, List[Dict], str]]:
+        payload = {'exclude_archived': exclude_archived, 'types': types}
+        for response, next_cursor in api_pages('conversations.list', payload, cursor):
+            yield types, response['channels'], next_cursor
+
+    if len(cursors) == 1:
+        for types, cursor in cursors.items():
+            yield from pages(types, cursor)
+        return
+
+    done = object()  # Put on a queue when its thread has listed every page of its type
+    stopping = threading.Event()  # Set when the caller stops reading
+    page_queues = {types: queue.Queue(maxsize=LIST_PAGES_AHEAD) for types in cursors}
+
+    def put(page_queue: queue.Queue, item) -> bool:
+        while not stopping.is_set():
+            try:
+                page_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def list_type(types: str, cursor: str) -> None:
+        type_pages = pages(types, cursor)
+        try:
+            for page in type_pages:
+                if not put(page_queues[types], page):
+                    return
+        except BaseException as e:  # Includes the SystemExit from api_call()
+            put(page_queues[types], e)
+        finally:
+            type_pages.close()
+        put(page_queues[types], done)
+
+    for types, cursor in cursors.items():
+        threading.Thread(target=list_type, args=(types, cursor), daemon=True).start()
+
+    try:
+        for page_queue in page_queues.values():
+            while True:
+                item = page_queue.get()
+                if item is done:
+                    break
+                elif isinstance(item, BaseException):
+                    raise item
+                yield item
+    finally:
+        stopping.set()
+
+
+def iter_channels(
+        include_private: bool = False,
+        exclude_archived: bool = True,
+        refresh: bool = False,
+        resume: bool = False,
+        max_age: float = None
+) -> Iterator[Channel]:
+    """
+    Yields every channel in the org, a page at a time as they are listed.
     Only checks for public, unarchived channels unless specified otherwise.
+    Public and private channels are listed at the same time. See list_pages().
+    A listing saved less than CHANNEL_CACHE_TTL_MINUTES ago is reused instead of calling the API.
+    Each page is saved to CHECKPOINT_FILE and CHANNEL_CACHE_FILE as it arrives, so the listing isn't kept in memory.
+    Only the fields in Channel are kept. See channels.py.
 
     :param: include_private: Set to True if private channels should be included
     :param: exclude_archived: Set to False if archived channel should be included
-    :return: results: A list of channel objects
+    :param: refresh: Set to True to ignore any saved listing
+    :param: resume: Set to True to carry on from the listing saved in CHECKPOINT_FILE by an interrupted run
+    :param: max_age: Seconds a saved listing can be old and still be used. Defaults to CHANNEL_CACHE_TTL_MINUTES.
+    :return: Iterator of Channel
     """
-    # Improvement idea: Have a local list of channels. If that last was recently generated, return that
-    print('Getting a list of all channels...')
-
-    endpoint = 'conversations.list'
-    content = 'application/x-www-form-urlencoded'
-    results = []
-
+    config = get_config()
     if include_private:
         types = 'public_channel,private_channel'
     else:
         types = 'public_channel'
 
-    cursor = None
-    while True:
-        payload = {
-            'cursor': cursor,
-            'exclude_archived': exclude_archived,
-            'types': types,
-            'limit': 200  # Actual max = 1,000 but Slack docs recommend 200 max
-        }
+    channel_cache = get_channel_cache(config.CHANNEL_CACHE_FILE, config.CHANNEL_CACHE_TTL_MINUTES)
+    checkpoint = get_checkpoint(config.CHECKPOINT_FILE)
+    cache_key = f'{types}|exclude_archived={exclude_archived}'
 
-        response = api_call(endpoint, content_type=content, payload=payload)
+    # Progress saved by an interrupted run
+    if resume:
+        saved, cursor, listing_done = checkpoint.get_listing(cache_key)
+    else:
+        saved, cursor, listing_done = 0, None, False
+    if listing_done:
+        print(f'Using the {saved} channels listed before the run was interrupted.\n')
+        logging.info(f'Resumed channel list from checkpoint: {cache_key}')
+        yield from map(Channel.from_api, checkpoint.iter_listing(cache_key))
+        return
+
+    if not refresh and not cursor:
+        cached = channel_cache.get(cache_key, max_age)
+        if cached is not None:
+            print(f'Using saved list of {channel_cache.count(cache_key)} channels from {config.CHANNEL_CACHE_FILE}.\n')
+            logging.info(f'Using saved channel list: {cache_key}')
+            yield from map(Channel.from_api, cached)
+            return
 
-        results.extend(response['channels'])
+    print('Getting a list of all channels...')
+    channel_cache.start(cache_key)
+
+    # Cursor of every channel type not fully listed yet, saved to the checkpoint as JSON
+    if cursor:
+        print(f'Resuming after {saved} channels listed before the run was interrupted.')
+        cursors = json.loads(cursor)
+        resumed = checkpoint.iter_listing(cache_key)
+        while True:
+            chunk = list(itertools.islice(resumed, PREPARE_BATCH_SIZE))
+            if not chunk:
+                break
+            channel_cache.add_page(cache_key, chunk)
+            yield from map(Channel.from_api, chunk)
+    else:
+        cursors = {channel_type: '' for channel_type in types.split(',')}
+        checkpoint.start_listing(cache_key)
 
-        if not response["response_metadata"].get("next_cursor"):
-            break
-        cursor = response["response_metadata"]["next_cursor"]
+    start = time.perf_counter()
+    fetched = 0
+    sample = []  # First few channels listed, for the debug log
 
-    logging.debug(f'Channels: {results}')
+    for channel_type, channels, next_cursor in list_pages(dict(cursors), exclude_archived):
+        if next_cursor:
+            cursors[channel_type] = next_cursor
+        else:
+            del cursors[channel_type]
+
+        page = channel_list_from_api(channels, listed_at=time.time())
+        del channels  # The full channel objects aren't needed past this point
+        saved_page = [channel.to_dict() for channel in page]
+        checkpoint.add_page(cache_key, saved_page, json.dumps(cursors) if cursors else '')
+        channel_cache.add_page(cache_key, saved_page)
+        del saved_page
+        sample.extend(page[:DEBUG_DUMP_LIMIT - len(sample)])
+        fetched += len(page)
+
+        yield from page
+
+    elapsed = time.perf_counter() - start
+    rate = fetched / elapsed if elapsed else 0.0
+    get_metrics().set('listing_channels_per_second', round(rate, 1))
+    print(f'Listed {fetched} channels in {elapsed:.1f} seconds ({rate:.0f} channels/second).')
+    logging.info(f'Listed {fetched} channels in {elapsed:.1f} seconds ({rate:.0f} channels/second).')
+
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(describe_channels(sample, total=fetched))
     print()
 
-    return results
+    channel_cache.finish(cache_key)
+
+    return None
+
+
+def get_channels(
+        include_private: bool = False,
+        exclude_archived: bool = True,
+        refresh: bool = False
+) -> List[Channel]:
+    """
+    Gets a list of all channels in the org. See iter_channels().
+
+    :param: include_private: Set to True if private channels should be included
+    :param: exclude_archived: Set to False if archived channel should be included
+    :param: refresh: Set to True to ignore any saved listing
+    :return: results: A list of Channel
+    """
+    return list(iter_channels(include_private, exclude_archived, refresh))
+
 
+def get_channel_id(name: str) -> str:
+    """
+    Returns the ID of the channel with the given name.
+    Uses the saved channel list, so the workspace is only listed if that list is missing or out of date.
+
+    :param name: Channel name. "#" is optional.
+    :return: str: The channel ID. Empty string if there is no such channel.
+    """
+    config = get_config()
+    name = name.lstrip('#')
+
+    channel_id = get_channel_cache(config.CHANNEL_CACHE_FILE, config.CHANNEL_CACHE_TTL_MINUTES).get_id(name)
+    if channel_id:
+        return channel_id
+
+    for channel in iter_channels():
+        if channel.name == name:
+            return channel.id
+
+    return ''
+
+
+def get_rules() -> ExemptionRules:
+    """
+    Returns the exemption rules, compiling them on first use and again whenever the config changes.
+    Rules come from EXEMPT_CHANNELS_RAW, ALLOWLIST_KEYWORDS_RAW, EXEMPT_SUBTYPES_RAW and RULES_FILE.
 
-def is_channel_exempt(channel: Dict) -> bool:
+    :return: ExemptionRules
+    """
+    global _rules, _rules_config
+
+    config = get_config()
+
+    with _rules_lock:
+        if _rules is None or _rules_config is not config:
+            _rules_config = config
+            _rules = compile_rules(
+                exempt_channels_raw=config.EXEMPT_CHANNELS_RAW,
+                keywords_raw=config.ALLOWLIST_KEYWORDS_RAW,
+                exempt_subtypes_raw=config.EXEMPT_SUBTYPES_RAW,
+                rules_file=config.RULES_FILE,
+            )
+
+    return _rules
+
+
+def get_exempt_reason(channel: Channel) -> str:
     """
     Checks to see if the given channel object is exempt from being archived.
     A channel can be exempt due to one of the following reasons:
     - Has more than the MIN_MEMBERS (if MIN_MEMBERS > 0)
-    - Channel name is listed in EXEMPT_CHANNELS_RAW
-    - Channel topic has a keyword listed in ALLOWLIST_KEYWORDS_RAW
+    - Channel name is listed in EXEMPT_CHANNELS_RAW or RULES_FILE, or matches a pattern listed there
+    - Channel topic or purpose has a keyword listed in ALLOWLIST_KEYWORDS_RAW or RULES_FILE
     - Channel is created recently (within the TOO_OLD_DATE date)
 
-    :param channel: Channel object
-    :return: bool: True if exempt, False if it should be archived
+    :param channel: Channel
+    :return: str: Why the channel is exempt. Empty string if it is not exempt.
     """
-    channel_name = channel['name'].strip()
-    if MIN_MEMBERS and len(channel['members']) >= MIN_MEMBERS:
-        logging.info(f'{channel_name} is exempt via number of members.')
-        print(f'{channel_name} is exempt via number of members.')
-        return True
+    config = get_config()
+    rules = get_rules()
 
-    exempt_channels = [x.strip() for x in EXEMPT_CHANNELS_RAW.splitlines() if x]
-    if channel_name in exempt_channels:
-        logging.info(f'{channel_name} is exempt via allow list.')
-        print(f'{channel_name} is exempt via allow list')
-        return True
+    channel_name = channel.name.strip()
+    # num_members comes with conversations.list, so no member list has to be fetched for this check
+    if config.MIN_MEMBERS and channel.num_members >= config.MIN_MEMBERS:
+        return 'number of members'
+
+    reason = rules.name_reason(channel_name)
+    if reason:
+        return reason
+
+    reason = rules.text_reason(channel.topic, channel.purpose)
+    if reason:
+        return reason
+
+    if channel.created >= config.CREATED_CUTOFF:
+        creation_date = datetime.fromtimestamp(channel.created).date()
+        return f'creation date ({creation_date})'
+
+    return ''
 
-    channel_topic = channel['topic']['value']
-    exempt_keywords = [x.strip() for x in ALLOWLIST_KEYWORDS_RAW.splitlines() if x]
-    exempt_topic = any(word in channel_topic for word in exempt_keywords)
-    if channel_topic and exempt_topic:
-        logging.info(f'{channel_name} is exempt via channel topic.')
-        print(f'{channel_name} is exempt via channel topic')
-        return True
 
-    creation_date = datetime.fromtimestamp(float(channel['created'])).date()
-    if creation_date > TOO_OLD_DATE:
-        logging.info(f'{channel_name} is exempt due to creation date ({creation_date}).')
-        print(f'{channel_name} is exempt via creation date ({creation_date})')
+def is_channel_exempt(channel: Channel) -> bool:
+    """
+    Checks to see if the given channel object is exempt from being archived.
+    See get_exempt_reason() for the reasons a channel can be exempt.
+
+    :param channel: Channel
+    :return: bool: True if exempt, False if it should be archived
+    """
+    reason = get_exempt_reason(channel)
+
+    if reason:
+        logging.info(f'{channel.name.strip()} is exempt via {reason}.')
+        print(f'{channel.name.strip()} is exempt via {reason}')
         return True
 
     return False
 
 
-def is_channel_active(channel_id: str) -> bool:
+def get_last_activity(channel_id: str) -> Optional[float]:
     """
-    - Determines if any valid messages have been sent to the channel.
-    - If so, any in the last "DAYS_INACTIVE" set in config.py?
-    - If so, returns True. Returns False otherwise
+    Returns the time of the latest message in the channel that counts as activity.
+
+    Only messages from TOO_OLD_DATE on are fetched, newest first, HISTORY_PAGE_SIZE at a time.
+    Paging stops at the first message that isn't an exempt subtype,
+    so a channel whose latest message is ex. the bot joining still only takes one call.
 
     :param channel_id: Slack channel ID
-    :return: bool
+    :return: Epoch time of the message, or None if there is no such message since TOO_OLD_DATE.
     """
-    skip_subtypes = [x.strip() for x in EXEMPT_SUBTYPES_RAW.splitlines() if x]
+    config = get_config()
+    rules = get_rules()
     endpoint = 'conversations.history'
     content = 'application/x-www-form-urlencoded'
 
     payload = {
         'channel': channel_id,
-        'count': 1,
+        'limit': config.HISTORY_PAGE_SIZE,
+        'oldest': config.TOO_OLD_TS,
         'inclusive': True
     }
 
-    response = api_call(endpoint, content_type=content, payload=payload)
-    logging.debug(response)
+    pages = 0
+    last_message_ts = None
 
-    if not response.get('messages'):
-        # No messages in channel.
-        # Newly created channels are already skipped via is_channel_exempt()
+    while True:
+        response = api_call(endpoint, content_type=content, payload=payload)
+        pages += 1
+
+        for message in response.get('messages', []):
+            if not rules.is_exempt_subtype(message.get('subtype')):
+                last_message_ts = float(message['ts'])
+                break
+
+        cursor = response.get('response_metadata', {}).get('next_cursor')
+        if last_message_ts is not None or not response.get('has_more') or not cursor:
+            # No messages at all means the channel is inactive.
+            # Newly created channels are already skipped via is_channel_exempt()
+            break
+
+        payload['cursor'] = cursor
+
+    metrics = get_metrics()
+    metrics.add('history_channels_scanned')
+    metrics.add('history_pages', pages)
+    metrics.set_max('history_pages_max', pages)
+    if pages > 1:
+        metrics.add('history_multi_page_channels')
+    logging.debug('%s: %s history page(s) read', channel_id, pages)
+
+    return last_message_ts
+
+
+def is_known_active(channel_id: str, updated: int = 0) -> bool:
+    """
+    Checks the state saved by previous runs without making any API calls.
+    Only used when INCREMENTAL is set.
+
+    :param channel_id: Slack channel ID
+    :param updated: The channel's "updated" field from conversations.list
+    :return: bool: True if a previous run found a message well inside DAYS_INACTIVE.
+    """
+    config = get_config()
+    if not config.INCREMENTAL:
         return False
 
-    message = response['messages'][0]
-    if 'subtype' in message and message['subtype'] in skip_subtypes:
-        # Not a message type that we care about
+    state = get_state_store(config.STATE_FILE).get(channel_id)
+    if not state or not state['last_message_ts'] or state['updated'] != int(updated or 0):
         return False
 
-    message_date = datetime.fromtimestamp(float(message['ts'])).date()
-    if message_date < TOO_OLD_DATE:
-        # Message is too old
+    last_date = datetime.fromtimestamp(state['last_message_ts']).date()
+
+    return last_date > config.TOO_OLD_DATE + timedelta(days=config.STATE_MARGIN_DAYS)
+
+
+def is_active_from_events(channel_id: str) -> Optional[bool]:
+    """
+    Checks the activity index kept by events.py without making any API calls.
+    Only used when ACTIVITY_INDEX_FILE is set.
+
+    :param channel_id: Slack channel ID
+    :return: True if an event showed a message since TOO_OLD_DATE.
+        False if the channel had events, but none since TOO_OLD_DATE, and events were tracked for that whole time
+        without a gap in the receiver's heartbeats.
+        None if the events don't tell, so the history has to be checked.
+    """
+    config = get_config()
+    if not config.ACTIVITY_INDEX_FILE:
+        return None
+
+    index = get_activity_index(config.ACTIVITY_INDEX_FILE)
+    last_event_ts = index.get(channel_id)
+
+    if last_event_ts is None:
+        return None
+    if last_event_ts >= config.TOO_OLD_TS:
+        return True
+    tracked_since = index.tracked_since(config.EVENTS_FLUSH_SECONDS * HEARTBEAT_MISSES)
+    if tracked_since is not None and tracked_since <= config.TOO_OLD_TS:
         return False
 
-    return True
+    return None
+
+
+def is_channel_active(channel_id: str, updated: int = 0) -> bool:
+    """
+    - Determines if any valid messages have been sent to the channel.
+    - If so, any in the last "DAYS_INACTIVE" set in config.py?
+    - If so, returns True. Returns False otherwise
+
+    When INCREMENTAL is set, channels that had a message well inside DAYS_INACTIVE
+    on a previous run are treated as active without checking their history again.
+    When ACTIVITY_INDEX_FILE is set, channels seen in message events are answered from
+    the events instead. See is_active_from_events().
+
+    :param channel_id: Slack channel ID
+    :param updated: The channel's "updated" field from conversations.list
+    :return: bool
+    """
+    config = get_config()
+    if is_known_active(channel_id, updated):
+        logging.info(f'{channel_id} was active on the last run. Skipping history check.')
+        return True
+
+    active = is_active_from_events(channel_id)
+    if active is not None:
+        get_metrics().add('history_checks_avoided_by_events')
+        logging.info(f'{channel_id} is {"active" if active else "inactive"} according to message events.')
+        last_message_ts = get_activity_index(config.ACTIVITY_INDEX_FILE).get(channel_id)
+    else:
+        last_message_ts = get_last_activity(channel_id)
+
+        if last_message_ts is None:
+            active = False
+        else:
+            message_date = datetime.fromtimestamp(last_message_ts).date()
+            active = message_date >= config.TOO_OLD_DATE  # Otherwise message is too old
+
+    get_state_store(config.STATE_FILE).record(channel_id, last_message_ts, 'active' if active else 'inactive', updated)
+
+    return active
+
+
+def load_user_directory(force: bool = False) -> UserCache:
+    """
+    Returns the local user directory, loading it via users.list if needed.
+    The directory is reloaded once it is older than USER_CACHE_TTL_HOURS.
+    A reload only rewrites users whose profile changed since the last load.
+
+    :param force: Set to True to reload even if the directory is still fresh.
+    :return: UserCache: The loaded user directory.
+    """
+    config = get_config()
+    directory = get_user_cache(config.USER_CACHE_FILE, config.USER_CACHE_TTL_HOURS)
+
+    with _directory_lock:
+        if force or directory.is_stale():
+            _load_user_directory(directory)
+
+    return directory
+
+
+def _load_user_directory(directory: UserCache) -> None:
+    """
+    Pages through users.list and adds every user to the given directory.
+
+    :param directory: The UserCache to load into.
+    :return: None
+    """
+    print('Loading the user directory...')
+    logging.info('Loading the user directory...')
+
+    changed = 0
+
+    for response, _ in api_pages('users.list', {}):
+        changed += directory.upsert(response['members'])
+
+    directory.mark_loaded()
+    logging.info(f'User directory loaded. {changed} user(s) added or changed.')
+    print()
+
+    return None
+
+
+class MemberResolver:
+    """
+    Resolves member IDs to names for a whole run, each unique user at most once.
+    Names come from the local user directory. Users missing from it (joined after it was loaded)
+    are looked up with users.info on LOOKUP_WORKERS threads, paced by the Tier 4 rate limit in api_call().
+    """
+
+    def __init__(self, directory: UserCache, workers: int):
+        """
+        :param directory: The loaded user directory.
+        :param workers: users.info calls made at the same time.
+        """
+        self.directory = directory
+        self.total = 0  # Member IDs resolved, counting a user once per channel
+        self._names = {}  # User ID: name, or a Future for the name while users.info is called
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='users.info')
+
+    def submit(self, user_ids: List[str]) -> None:
+        """
+        Starts resolving the given users. Call as each page of members arrives,
+        so lookups run while the rest of the pages are fetched.
+
+        :param user_ids: Member IDs.
+        :return: None
+        """
+        metrics = get_metrics()
+
+        with self._lock:
+            self.total += len(user_ids)
+            new = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in self._names]
+
+            for user_id in new:
+                name = self.directory.get_name(user_id)
+                if name is None:  # User joined after the directory was loaded
+                    name = self._executor.submit(self._look_up, user_id)
+                    metrics.add('member_lookups')
+                self._names[user_id] = name
+
+        metrics.add('member_names_total', len(user_ids))
+        metrics.add('member_names_unique', len(new))
+
+        return None
+
+    def get_name(self, user_id: str) -> str:
+        """
+        :param user_id: A member ID given to submit().
+        :return: str: The user's name. Waits for users.info if the lookup is still running.
+        """
+        with self._lock:
+            name = self._names[user_id]
+
+        return name.result() if isinstance(name, Future) else name
+
+    def unique(self) -> int:
+        """
+        :return: int: Number of different users resolved.
+        """
+        with self._lock:
+            return len(self._names)
+
+    def _look_up(self, user_id: str) -> str:
+        user_info = api_call('users.info', payload={'user': user_id})
+        self.directory.upsert([user_info['user']])
+
+        return get_user_name(user_info['user'])
+
+    def close(self) -> None:
+        """
+        Waits for any lookups still running and stops the worker threads.
+
+        :return: None
+        """
+        self._executor.shutdown(wait=True)
+
+        return None
+
+
+_resolver = None  # MemberResolver for the current run. See get_member_resolver()
+_resolver_lock = threading.Lock()
+
+
+def get_member_resolver() -> MemberResolver:
+    """
+    Returns the MemberResolver for the current run, loading the user directory on first use.
+
+    :return: MemberResolver
+    """
+    global _resolver
+
+    with _resolver_lock:
+        if _resolver is None:
+            _resolver = MemberResolver(load_user_directory(), get_config().LOOKUP_WORKERS)
+
+    return _resolver
+
+
+def report_member_names() -> None:
+    """
+    Prints and logs how many member names were resolved and how many of those were different users.
+    Closes the run's MemberResolver, so the next run starts a new one.
+
+    :return: None
+    """
+    global _resolver
+
+    with _resolver_lock:
+        resolver, _resolver = _resolver, None
+
+    if resolver is None:
+        return None
+
+    resolver.close()
+    unique = resolver.unique()
+    ratio = unique / resolver.total if resolver.total else 0.0
+    get_metrics().set('member_names_unique_ratio', round(ratio, 3))
+
+    print(f'Resolved {resolver.total} member name(s): {unique} different user(s) ({ratio:.0%}).')
+    logging.info(f'Resolved {resolver.total} member name(s): {unique} different user(s) ({ratio:.0%}).')
+
+    return None
 
 
 def get_channel_members(channel_id: str) -> list:
     """
     Returns a list of the member names of the given channel ID.
+    Names are resolved by the run's MemberResolver as each page of members arrives.
+    users.info is only called for users missing from the local user directory, once per user per run.
 
     :param channel_id: Channel ID to get members from.
     :return: results: List of member names.
     """
-    # Improvement idea: Have a local list of members. If that last was recently generated, return that
     members_endpoint = 'conversations.members'  # Returns member IDs
-    users_endpoint = 'users.info'  # Returns all user info including name
+    resolver = get_member_resolver()
 
     members = []  # All member IDs
-    results = []  # Just the member names parsed from "members"
 
-    cursor = None
-    while True:
-        members_payload = {
-            'channel': channel_id,
-            'cursor': cursor,
-            'limit': 200  # Actual max = 1,000 but Slack docs recommend 200 max
-        }
-        response = api_call(
-            members_endpoint,
-            payload=members_payload,
-            content_type='application/x-www-form-urlencoded',
-        )
+    for response, _ in api_pages(members_endpoint, {'channel': channel_id}):
         members.extend(response['members'])
+        resolver.submit(response['members'])
 
-        if not response['response_metadata'].get('next_cursor'):
-            break
-
-        cursor = response['response_metadata']['next_cursor']
-
-    for member in members:
-        users_payload = {'user': member}
-        user_info = api_call(users_endpoint, payload=users_payload)
-
-        profile = user_info['user']['profile']
-        name = profile['real_name']
-
-        results.append(name)
+    results = [resolver.get_name(member) for member in members]  # Just the member names
 
     return results
 
 
 def send_message(
         msg: str,
-        channel: str = DEFAULT_NOTIFICATION_CHANNEL,
-) -> None:
+        channel: str = None,
+        allowed_errors: tuple = ()
+) -> Dict:
     """
     Helper function used to send the given message to the given channel.
 
     :param msg: The message to send.
-    :param channel: The channel to send to. Can be a channel name or ID.
-    :return: None
+    :param channel: The channel to send to. Can be a channel name or ID. Defaults to DEFAULT_NOTIFICATION_CHANNEL.
+    :param allowed_errors: Slack errors to return instead of exiting. See api_call().
+    :return: Dict: The API response.
     """
+    if channel is None:
+        channel = get_config().DEFAULT_NOTIFICATION_CHANNEL
+
     # Would be better to use blocks instead of just text
     endpoint = 'chat.postMessage'
     payload = {
@@ -348,207 +1092,541 @@ def send_message(
         "text": msg
     }
 
-    api_call(endpoint, json_data=payload, method='POST')
-
-    return None
+    return api_call(endpoint, json_data=payload, method='POST', allowed_errors=allowed_errors)
 
 
 def write_results(
     team_id: str,
-    results: list
+    results: Iterable[Dict]
 ) -> None:
     """
     Takes in the results of the archive_channels function.
-    Writes them out to RESULTS_FILE.
+    Writes them out to RESULTS_FILE, and to RESULTS_EXPORT_FILE if set.
 
     :param team_id: Slack instance team ID.
-    :param results: List of results from archive_channels().
+    :param results: Results from evaluate_channel(). Can be a generator.
     :return: None
     """
-    try:
-        with open(
-                RESULTS_FILE, mode='w', encoding='utf-8', newline=''
-        ) as csvfile:
-            writer = csv.writer(csvfile, quoting=csv.QUOTE_ALL)
-            headers = ['Channel ID', 'Channel Name', 'Users', 'Successfully Archived?', 'Channel Link']
-            writer.writerow(headers)
-
-            for result in results:
-                channel_id = result['id']
-                channel_name = result['name']
-                channel_users = '\n'.join(result['users'])
-                channel_link = f'https://app.slack.com/client/{team_id}/{channel_id}'
-
-                if result['archived']:
-                    archived = 'Yes'
-                else:
-                    archived = 'No'
-
-                row = [
-                    channel_id,
-                    channel_name,
-                    channel_users,
-                    archived,
-                    channel_link,
-                ]
-
-                writer.writerow(row)
-    except OSError:
-        print(f'Error opening: {RESULTS_FILE}')
-        print('Continuing script. Data will be in the log file.')
-
+    config = get_config()
+    with ResultsWriter(config.RESULTS_FILE, team_id, config.RESULTS_EXPORT_FILE) as writer:
         for result in results:
-            logging.critical(f"Channel: {result['name']}")
-            channel_users = '\n'.join(result['users'])
-            logging.critical(channel_users)
-            logging.critical(dashes)
+            writer.write(result)
 
     return None
 
 
-def archive_channels(channels: list) -> None:
+def archive_channel(result: Dict, team_id: str) -> Dict:
+    """
+    Sends the archive notice to the channel and archives it.
+    Progress is saved to the checkpoint after each step, so a resumed run never notifies a channel twice.
+
+    :param result: Result from evaluate_channel() for the channel.
+    :param team_id: Slack instance team ID.
+    :return: Dict: The result with "archived" set, and "error" set if archiving failed.
+    """
+    config = get_config()
+    channel_id = result['id']
+    channel_name = result['name']
+    checkpoint = get_checkpoint(config.CHECKPOINT_FILE)
+
+    if not result.get('notified'):
+        response = send_message(
+            channel=channel_id,
+            msg=archived_message.format(
+                days=config.DAYS_INACTIVE,
+                channel_link=f'https://app.slack.com/client/{team_id}/{channel_id}'
+            ),
+            allowed_errors=NOTIFY_ERRORS,
+        )
+        if response.get('error'):
+            print(f'Error sending message to {channel_name}.')
+            logging.warning(f"Error sending message to {channel_name}: {response['error']}")
+
+        result['notified'] = True
+        checkpoint.save_decision(channel_id, result)
+
+    endpoint = 'conversations.archive'
+    response = api_call(
+        method='POST',
+        endpoint=endpoint,
+        json_data={"channel": channel_id},
+        allowed_errors=ARCHIVE_ERRORS + RETRYABLE_ERRORS
+    )
+
+    # already_archived: Archived before an interrupted run stopped, or by an earlier attempt
+    if response.get('error') and response['error'] != 'already_archived':
+        print(f'ERROR archiving: {channel_name}')
+        print(response['error'])
+        logging.warning(f"{channel_name}: {response['error']}")
+        result['archived'] = False
+        result['error'] = response['error']
+    else:
+        result['archived'] = True
+        result.pop('error', None)
+
+    checkpoint.save_decision(channel_id, result)
+
+    return result
+
+
+def archive_with_retry(result: Dict, team_id: str) -> Dict:
+    """
+    Archives the channel in the given result, retrying up to ARCHIVE_RETRIES times
+    if Slack returns an error that may go away on its own.
+
+    :param result: Result from evaluate_channel() for the channel.
+    :param team_id: Slack instance team ID.
+    :return: Dict: The result with "archived" set.
+    """
+    config = get_config()
+    if result.get('archived') is not None:
+        return result  # Already decided, ex. on a resumed run
+
+    for attempt in range(config.ARCHIVE_RETRIES + 1):
+        result['archived'] = None
+        result = archive_channel(result, team_id)
+
+        if result['archived'] or result.get('error') not in RETRYABLE_ERRORS:
+            break
+
+        backoff = 2 ** attempt
+        logging.warning(f"Retrying archive of {result['name']} after {backoff} seconds.")
+        time.sleep(backoff)
+
+    return result
+
+
+def execute_archives(results: Iterable[Dict], team_id: str) -> Iterator[Dict]:
     """
-    - Takes in a list of channel objects.
+    Archives the channels in the given results, up to ARCHIVE_WORKERS at a time.
+    Each channel is notified and then archived.
+    Results are yielded in the order they were given, as soon as each is done.
+
+    :param results: Results from evaluate_channel(). Can be a generator.
+    :param team_id: Slack instance team ID.
+    :return: Iterator of results with "archived" set.
+    """
+    config = get_config()
+    return ordered_map(lambda result: archive_with_retry(result, team_id), results, config.ARCHIVE_WORKERS)
+
+
+def reconcile_archives(failed: List[Dict]) -> Dict[str, bool]:
+    """
+    Final pass over channels that could not be archived.
+    Checks each one with conversations.info, since a failed call may still have archived the channel.
+
+    :param failed: Results where archiving failed.
+    :return: Dict of channel ID: True for channels that turned out to be archived.
+    """
+    config = get_config()
+    corrections = {}
+
+    for result in failed:
+        response = api_call(
+            'conversations.info',
+            payload={'channel': result['id']},
+            content_type='application/x-www-form-urlencoded',
+            allowed_errors=('channel_not_found',),
+        )
+        if response.get('channel', {}).get('is_archived'):
+            print(f"{result['name']} is archived after all.")
+            logging.info(f"Reconciled: {result['name']} is archived.")
+            result['archived'] = True
+            get_checkpoint(config.CHECKPOINT_FILE).save_decision(result['id'], result)
+            corrections[result['id']] = True
+
+    return corrections
+
+
+def evaluate_channel(channel: Channel, team_id: str) -> Optional[Dict]:
+    """
+    Checks to see if the given channel should be archived.
+    Channels are not archived here. See execute_archives().
+
+    The decision is saved to the checkpoint.
+    Channels decided before an interrupted run stopped are not checked again.
+
+    :param channel: Channel
+    :param team_id: Slack instance team ID.
+    :return: The result for write_results() if the channel should be archived, None if skipped.
+        In a dry run "archived" is True. Otherwise it is None until the channel is archived.
+    """
+    config = get_config()
+    channel_id = channel.id
+    channel_name = channel.name
+    is_channel = channel.is_channel  # As opposed to a DM, group, etc.
+    checkpoint = get_checkpoint(config.CHECKPOINT_FILE)
+
+    decided, result = checkpoint.get_decision(channel_id)
+    if decided:
+        return result  # execute_archives() finishes any archive that was in progress
+
+    if not is_channel or is_channel_exempt(channel):
+        print(f'Skipping: {channel_name}')
+        checkpoint.save_decision(channel_id, None)
+        return None
+
+    if is_channel_active(channel_id, channel.updated):
+        checkpoint.save_decision(channel_id, None)
+        return None
+
+    print(f'\nGetting member list for: {channel_name}...')
+    logging.info(f'\nGetting member list for: {channel_name}...')
+
+    result = {
+        'id': channel_id,
+        'name': channel_name,
+        'archived': None  # Not archived yet
+    }
+
+    users = get_channel_members(channel_id)
+    if users:
+        logging.info(f'{channel_name}: {len(users)} member(s)')
+        if logging.getLogger().isEnabledFor(logging.DEBUG):  # Full member lists are only logged at DEBUG
+            logging.debug(
+                users_logging_template.format(
+                    channel_name=channel_name,
+                    users='\t\n'.join(users)
+                )
+            )
+        result['users'] = users
+    else:
+        print(f'No members in: {channel_name}')
+        logging.info(f'No members in: {channel_name}')
+        result['users'] = []
+
+    if config.DRY_RUN:
+        print(f'DRY RUN: Would have archived: {channel_name}')
+        result['archived'] = True
+
+    checkpoint.save_decision(channel_id, result)
+
+    return result
+
+
+def ordered_map(func: Callable, items: Iterable, workers: int = None) -> Iterator:
+    """
+    Like map(), but runs func on up to "workers" items at once.
+    Results are yielded in the order of the given items.
+    At most a few items per worker are in flight, so memory use stays bounded no matter how many items there are.
+
+    :param func: Function to call on each item.
+    :param items: Items to call func on.
+    :param workers: Threads to use. 1 = call func in this thread. Defaults to WORKERS.
+    :return: Iterator of func's results.
+    """
+    if workers is None:
+        workers = get_config().WORKERS
+
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    window = workers * 4
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def archive_channels(channels: Iterable[Channel]) -> Dict:
+    """
+    - Takes in channels.
     - Checks to see if they should be archived.
     - Archives them if appropriate.
     - Writes out the results to RESULTS_FILE
 
-    :param channels: Channel objects
-    :return: None
+    Channels are evaluated by up to WORKERS threads at once.
+    Channels to archive are passed straight on to execute_archives(), which archives up to ARCHIVE_WORKERS at once.
+    Channels that still failed are checked once more by reconcile_archives() at the end.
+    Results are kept in the order of the given channels,
+    so the results file is the same as a run with a single worker.
+    Each result is written out as soon as it is ready instead of being kept in memory.
+
+    :param channels: Channels
+    :return: Dict with the number of "results" written, channels "archived" and channels that "failed".
     """
-    results = []
+    config = get_config()
     team_id = api_call('/auth.test')['team_id']
+    archived_index = get_archived_index(config.STATE_FILE)
+    channel_cache = get_channel_cache(config.CHANNEL_CACHE_FILE, config.CHANNEL_CACHE_TTL_MINUTES)
+    archived = 0
+    failed = []
+    corrections = {}
+
+    decisions = (
+        result
+        for result in ordered_map(lambda channel: evaluate_channel(channel, team_id), channels)
+        if result is not None
+    )
+    if not config.DRY_RUN:
+        decisions = execute_archives(decisions, team_id)
+
+    with ResultsWriter(config.RESULTS_FILE, team_id, config.RESULTS_EXPORT_FILE) as writer:
+        for result in decisions:
+            writer.write(result)
+
+            if result['archived']:
+                archived += 1
+                if not config.DRY_RUN:
+                    archived_index.record(result['id'], result['name'])
+                    channel_cache.remove([result['id']])  # The saved list is still used until it expires
+            else:
+                failed.append({'id': result['id'], 'name': result['name']})
+
+        if failed and not config.DRY_RUN:
+            print(f'\nChecking {len(failed)} channel(s) that could not be archived...')
+            corrections = reconcile_archives(failed)
+            writer.correct(corrections)
+            for result in failed:
+                if result['id'] in corrections:
+                    archived_index.record(result['id'], result['name'])
+            channel_cache.remove(corrections)
+            archived += len(corrections)
+
+    print(f'{writer.rows} result(s) written to: {config.RESULTS_FILE}')
+    logging.info(f'{writer.rows} result(s) written to: {config.RESULTS_FILE}')
+
+    return {
+        'results': writer.rows,
+        'archived': archived,
+        'failed': len(failed) - len(corrections),
+    }
 
-    for channel in channels:
-        channel_id = channel['id']
-        channel_name = channel['name']
-        is_channel = channel['is_channel']  # As opposed to a DM, group, etc.
 
-        if is_channel and not is_channel_exempt(channel):
-            if is_channel_active(channel_id):
-                continue
-            print(f'\nGetting member list for: {channel_name}...')
-            logging.info(f'\nGetting member list for: {channel_name}...')
-
-            result = {
-                'id': channel_id,
-                'name': channel_name
-            }
-
-            users = get_channel_members(channel_id)
-            if users:
-                logging.info(
-                    users_logging_template.format(
-                        channel_name=channel_name,
-                        users='\t\n'.join(users)
-                    )
-                )
-                result['users'] = users
-            else:
-                print(f'No members in: {channel_name}')
-                logging.info(f'No members in: {channel_name}')
-                result['users'] = []
-
-            endpoint = 'conversations.archive'
-            if not DRY_RUN:
-                try:
-                    send_message(
-                        channel=channel_name,
-                        msg=archived_message.format(
-                            days=DAYS_INACTIVE,
-                            channel_link=f'https://app.slack.com/client/{team_id}/{channel_id}'
-                        )
-                    )
-                except Exception as e:
-                    print(f'Error sending message to {channel_name}.')
-                    logging.warning(f'Error sending message to {channel_name}.')
-                    logging.warning(e)
-
-                response = api_call(
-                    method='POST',
-                    endpoint=endpoint,
-                    json_data={"channel": channel_id}
-                )
+def get_unarchive_churn() -> str:
+    """
+    Describes how many channels archived in the last ARCHIVED_INDEX_DAYS were unarchived again.
+    Uses only the local index kept by archive_channels() and check_unarchived().
 
-                if response.get('error'):
-                    print(f'ERROR archiving: {channel_name}')
-                    print(response['error'])
-                    logging.warning(channel_name + response['error'])
-                    result['archived'] = False
-                else:
-                    result['archived'] = True
-            else:
-                print(f'DRY RUN: Would have archived: {channel_name}')
-                result['archived'] = True
+    :return: str: Message for the admin report. Empty string if nothing was unarchived.
+    """
+    config = get_config()
+    archived_index = get_archived_index(config.STATE_FILE)
+    since = time.time() - config.ARCHIVED_INDEX_DAYS * 24 * 60 * 60
 
-            results.append(result)
-        else:
-            print(f'Skipping: {channel_name}')
+    unarchived = archived_index.unarchived_since(since)
+    if not unarchived:
+        return ''
 
-    team_id = api_call('/auth.test')['team_id']
-    write_results(team_id, results)
-    return None
+    names = ', '.join(f"#{channel['name']}" for channel in unarchived[:DEBUG_DUMP_LIMIT])
+    more = f' and {len(unarchived) - DEBUG_DUMP_LIMIT} more' if len(unarchived) > DEBUG_DUMP_LIMIT else ''
+
+    return (
+        f'{len(unarchived)} of {archived_index.archived_since(since)} channel(s) archived in the last '
+        f'{config.ARCHIVED_INDEX_DAYS} days were unarchived: {names}{more}'
+    )
 
 
 def send_admin_report(
-        channel_name: str = DEFAULT_NOTIFICATION_CHANNEL
+        channel_name: str = None
 ) -> None:
     """
     Sends a message indicating if this was a dry run or not.
-    Sends the RESULTS_FILE to the specified channel.
+    Sends RESULTS_EXPORT_FILE, or RESULTS_FILE if there is no export, to the specified channel.
 
+    :param channel_name: Channel to send the report to. Defaults to DEFAULT_NOTIFICATION_CHANNEL.
     :return: None
     """
+    config = get_config()
+    if channel_name is None:
+        channel_name = config.DEFAULT_NOTIFICATION_CHANNEL
+
     print('Sending admin report...')
-    if DRY_RUN:
+    if config.DRY_RUN:
         send_message('DRY RUN Results:', channel_name)
     else:
-        send_message('NOT a dry run. Results:')
-
-    if "#" in channel_name:
-        name = channel_name[1:]
-    else:
-        name = channel_name
+        send_message('NOT a dry run. Results:', channel_name)
 
-    channels = get_channels()
-    channel_id = ''
+    churn = get_unarchive_churn()
+    if churn:
+        send_message(churn, channel_name)
 
-    for channel in channels:
-        if channel['name'] == name:
-            channel_id = channel['id']
-            break
+    channel_id = get_channel_id(channel_name)
 
     if not channel_id:
         print('Error getting channel ID for specified channel.')
         print('See log for details.')
-        print(f'Results file name: {RESULTS_FILE}')
+        print(f'Results file name: {config.RESULTS_FILE}')
         return None
 
+    # The export is much smaller than the CSV for channels with many members
+    if config.RESULTS_EXPORT_FILE and os.path.exists(config.RESULTS_EXPORT_FILE):
+        upload_file, filetype = config.RESULTS_EXPORT_FILE, 'zip'
+    else:
+        upload_file, filetype = config.RESULTS_FILE, 'csv'
+
     try:
         endpoint = '/files.upload'
         payload = {
-            'token': API_TOKEN,
+            'token': config.API_TOKEN,
             'channels': channel_id,
             'title': 'Autoarchive Results',
-            'filename': RESULTS_FILE,
-            'filetype': 'csv',
+            'filename': os.path.basename(upload_file),
+            'filetype': filetype,
         }
-        with open(RESULTS_FILE, 'rb') as f:
-            files = {'file': (RESULTS_FILE, f)}
+        start = time.perf_counter()
+        with open(upload_file, 'rb') as f:
+            files = {'file': (os.path.basename(upload_file), f)}
             api_call(
                 method='POST', endpoint=endpoint, charset='', files=files,
                 content_type='multipart/form-data', payload=payload
             )
+        elapsed = time.perf_counter() - start
+        logging.info(f'Uploaded {upload_file} ({os.path.getsize(upload_file)} bytes) in {elapsed:.2f} seconds.')
     except Exception as e:
         print('Error reading file. See log for details.')
-        print(f'Results file name: {RESULTS_FILE}')
+        print(f'Results file name: {upload_file}')
         logging.warning(e)
 
     return None
 
 
+def check_unarchived(channels: List[Channel]) -> List[Dict]:
+    """
+    Finds channels archived by a recent run that have since been unarchived.
+    Uses the listing that was already made, so archived channels don't have to be listed.
+    A channel only counts if it was listed after it was archived. A listing saved before the archive
+    (ex. from the checkpoint of an interrupted run) still has it, but it was never unarchived.
+
+    :param channels: Unarchived channels in the listing. Ex. one batch from prepare_channels()
+    :return: The channels that were unarchived since the last run.
+    """
+    config = get_config()
+    archived_index = get_archived_index(config.STATE_FILE)
+
+    unarchived = archived_index.mark_unarchived(
+        (channel.id, channel.listed_at) for channel in channels if not channel.is_archived
+    )
+    get_metrics().add('unarchived_channels', len(unarchived))
+
+    for channel in unarchived:
+        print(f"{channel['name']} was unarchived since it was archived.")
+        logging.info(f"{channel['name']} ({channel['id']}) was unarchived since it was archived.")
+
+    return unarchived
+
+
+def prepare_channels(channels: Iterable[Channel]) -> Iterator[Channel]:
+    """
+    Yields the given channels PREPARE_BATCH_SIZE at a time as they are listed.
+    Each batch is checked for unarchived channels and joined where needed before it is yielded,
+    so the listing never has to be in memory all at once.
+
+    :param channels: Channels. Ex. from iter_channels()
+    :return: Iterator of Channel
+    """
+    channels = iter(channels)
+
+    while True:
+        batch = list(itertools.islice(channels, PREPARE_BATCH_SIZE))
+        if not batch:
+            return
+
+        check_unarchived(batch)
+        join_channels(batch)
+
+        yield from batch
+
+
+def evaluate(channels: Iterable[Channel], config: Config = None) -> Dict:
+    """
+    Library entry point. Joins, checks and (unless DRY_RUN) archives the given channels with the given settings.
+    Nothing is read from the env vars or set up on import, so this can be called many times in one process.
+
+    Ex.
+        from config import load_config, set_config
+        from main import evaluate, get_channels
+
+        config = set_config(load_config(DRY_RUN=True))
+        summary = evaluate(get_channels(), config)
+
+    :param channels: Channels. Ex. from iter_channels()
+    :param config: Settings to use. Defaults to the current config. See get_config().
+    :return: Dict: See archive_channels().
+    """
+    if config is not None:
+        set_config(config)
+    config = get_config()
+
+    if config.ACTIVITY_INDEX_FILE:
+        get_activity_index(config.ACTIVITY_INDEX_FILE).reload()  # Events received since the last run
+
+    # Channels archived more than ARCHIVED_INDEX_DAYS ago are forgotten
+    get_archived_index(config.STATE_FILE).prune(time.time() - config.ARCHIVED_INDEX_DAYS * 24 * 60 * 60)
+
+    try:
+        return archive_channels(prepare_channels(channels))
+    finally:
+        report_member_names()
+
+
+def run(
+        config: Config = None,
+        resume: bool = False,
+        refresh: bool = False,
+        report: bool = True,
+        max_age: float = None
+) -> Dict:
+    """
+    A full run: lists the channels, evaluates them, sends the admin report and reports stats.
+
+    :param config: Settings to use. Defaults to the current config. See get_config().
+    :param resume: Set to True to continue an interrupted run from CHECKPOINT_FILE.
+    :param refresh: Set to True to list the channels again even if the saved list is still fresh.
+    :param report: Set to False to skip the admin report.
+    :param max_age: Seconds a saved channel list can be old and still be used. See iter_channels().
+    :return: Dict: See archive_channels().
+    """
+    if config is not None:
+        set_config(config)
+    config = get_config()
+
+    checkpoint = get_checkpoint(config.CHECKPOINT_FILE)
+    if resume:
+        print('Resuming the last run. Channels already decided will not be checked again.')
+        logging.info('Resuming from checkpoint.')
+    else:
+        checkpoint.clear()
+
+    if not test_call():
+        logging.info(log_end)
+        raise Exception(
+            'Issue making a test API call. Check log for details.'
+        )
+
+    summary = evaluate(iter_channels(
+        include_private=config.INCLUDE_PRIVATE, refresh=refresh, resume=resume, max_age=max_age
+    ))
+    if report:
+        send_admin_report()
+    report_connection_stats()
+    report_metrics()
+    checkpoint.clear()
+
+    return summary
+
+
 if __name__ == '__main__':
-    if DRY_RUN:
+    parser = argparse.ArgumentParser(description='Archives inactive Slack channels.')
+    parser.add_argument(
+        '--resume', action='store_true',
+        help='Continue an interrupted run using the progress saved in CHECKPOINT_FILE.'
+    )
+    args = parser.parse_args()
+
+    config = set_config(load_config())
+    setup_logging(config)
+    print('API_TOKEN is set. Continuing...\n')
+
+    if config.DRY_RUN:
         print('This is only a dry run. No channels will be archived.')
     else:
         print('This IS NOT a dry run. Channels will be archived.')
@@ -557,16 +1635,7 @@ if __name__ == '__main__':
             logging.info(log_end)
             sys.exit(1)
 
-    if not test_call():
-        logging.info(log_end)
-        raise Exception(
-            'Issue making a test API call. Check log for details.'
-        )
-
-    all_channels = get_channels()
-    join_channels(all_channels)
-    archive_channels(all_channels)
-    send_admin_report()
+    run(resume=args.resume)
 
     logging.info('Script completed successfully.')
     logging.info(log_end)
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+import json
+import math
+import os
+import random
+import threading
+from collections import defaultdict
+from typing import Dict, List
+
+LATENCY_SAMPLES = 1000  # Most latencies kept per method for the percentiles. See MethodStats.add_latency().
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile.
+
+    :param values: Values sorted from smallest to largest.
+    :param pct: Percentile to get. Ex. 95
+    :return: float: The value at that percentile. 0 if there are no values.
+    """
+    if not values:
+        return 0.0
+
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+
+    return values[min(rank, len(values)) - 1]
+
+
+class MethodStats:
+    """
+    Everything recorded about calls to a single Slack API method.
+    Percentiles come from a random sample of up to LATENCY_SAMPLES latencies, so memory stays the same
+    however many calls are made. The latency total is exact.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latencies = []  # Sample of seconds per request
+        self.latency_total = 0.0
+        self.rate_limited = 0  # 429 responses
+        self.retry_sleep = 0.0  # Seconds spent waiting because of retry-after
+        self.pacing_wait = 0.0  # Seconds spent waiting for the rate limiter
+        self._random = random.Random(0)
+
+    def add_latency(self, latency: float) -> None:
+        """
+        Adds a latency to the total and, by reservoir sampling, to the sample. Call after counting the call.
+
+        :param latency: Seconds the request took.
+        :return: None
+        """
+        self.latency_total += latency
+
+        if len(self.latencies) < LATENCY_SAMPLES:
+            self.latencies.append(latency)
+        else:
+            index = self._random.randrange(self.calls)
+            if index < LATENCY_SAMPLES:
+                self.latencies[index] = latency
+
+        return None
+
+    def to_dict(self) -> Dict:
+        latencies = sorted(self.latencies)
+
+        return {
+            'calls': self.calls,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'latency_p50': percentile(latencies, 50),
+            'latency_p95': percentile(latencies, 95),
+            'latency_p99': percentile(latencies, 99),
+            'latency_total': self.latency_total,
+            'rate_limited': self.rate_limited,
+            'retry_sleep': self.retry_sleep,
+            'pacing_wait': self.pacing_wait,
+        }
+
+
+class Metrics:
+    """
+    Thread safe record of every API call made during a run, grouped by Slack method.
+    Also keeps named counters for anything else worth reporting. Ex. join calls avoided.
+    reset() starts a new run. The per method stats since the process started are kept for the Prometheus counters.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._methods = defaultdict(MethodStats)
+        self._totals = defaultdict(MethodStats)  # Same as _methods, but never reset
+        self._counters = defaultdict(float)
+
+    def reset(self) -> None:
+        """
+        Forgets the stats and counters of the last run. Used by daemon.py before each sweep.
+
+        :return: None
+        """
+        with self._lock:
+            self._methods = defaultdict(MethodStats)
+            self._counters = defaultdict(float)
+
+        return None
+
+    def record_call(
+            self,
+            method: str,
+            latency: float,
+            bytes_sent: int = 0,
+            bytes_received: int = 0,
+            rate_limited: bool = False
+    ) -> None:
+        """
+        Records a single HTTP request.
+
+        :param method: Slack API method name. Ex. "conversations.list"
+        :param latency: Seconds the request took.
+        :param bytes_sent: Size of the request body.
+        :param bytes_received: Size of the response body.
+        :param rate_limited: True if Slack returned a 429.
+        :return: None
+        """
+        with self._lock:
+            for stats in (self._methods[method], self._totals[method]):
+                stats.calls += 1
+                stats.bytes_sent += bytes_sent
+                stats.bytes_received += bytes_received
+                stats.add_latency(latency)
+                if rate_limited:
+                    stats.rate_limited += 1
+
+        return None
+
+    def record_wait(self, method: str, retry_sleep: float = 0.0, pacing_wait: float = 0.0) -> None:
+        """
+        Records time spent not making calls.
+
+        :param method: Slack API method name.
+        :param retry_sleep: Seconds Slack asked us to wait via retry-after.
+        :param pacing_wait: Seconds the rate limiter made the call wait.
+        :return: None
+        """
+        with self._lock:
+            for stats in (self._methods[method], self._totals[method]):
+                stats.retry_sleep += retry_sleep
+                stats.pacing_wait += pacing_wait
+
+        return None
+
+    def add(self, counter: str, value: float = 1) -> None:
+        """
+        Adds to a named counter.
+
+        :param counter: Name of the counter. Ex. "joins_avoided"
+        :param value: Amount to add.
+        :return: None
+        """
+        with self._lock:
+            self._counters[counter] += value
+
+        return None
+
+    def set(self, counter: str, value: float) -> None:
+        """
+        Sets a named counter to the given value.
+
+        :param counter: Name of the counter.
+        :param value: New value.
+        :return: None
+        """
+        with self._lock:
+            self._counters[counter] = value
+
+        return None
+
+    def set_max(self, counter: str, value: float) -> None:
+        """
+        Sets a named counter to the given value if it is higher than the current value.
+
+        :param counter: Name of the counter. Ex. "history_pages_max"
+        :param value: Value to compare.
+        :return: None
+        """
+        with self._lock:
+            self._counters[counter] = max(self._counters[counter], value)
+
+        return None
+
+    def to_dict(self) -> Dict:
+        """
+        :return: Dict with "methods" (method name: stats) and "counters" (name: value)
+        """
+        with self._lock:
+            return {
+                'methods': {method: stats.to_dict() for method, stats in sorted(self._methods.items())},
+                'counters': dict(sorted(self._counters.items())),
+            }
+
+    def summary_table(self) -> str:
+        """
+        :return: str: Human readable table of the per method stats and counters.
+        """
+        data = self.to_dict()
+        lines = [
+            f"{'Method':<24}{'Calls':>8}{'KB in':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+            f"{'429s':>6}{'Retry s':>9}{'Pacing s':>10}",
+            '-' * 94,
+        ]
+
+        for method, stats in data['methods'].items():
+            lines.append(
+                f"{method:<24}{stats['calls']:>8}{stats['bytes_received'] / 1024:>10.1f}"
+                f"{stats['latency_p50'] * 1000:>9.1f}{stats['latency_p95'] * 1000:>9.1f}"
+                f"{stats['latency_p99'] * 1000:>9.1f}{stats['rate_limited']:>6}"
+                f"{stats['retry_sleep']:>9.1f}{stats['pacing_wait']:>10.1f}"
+            )
+
+        for counter, value in data['counters'].items():
+            lines.append(f'{counter}: {value:g}')
+
+        return '\n'.join(lines)
+
+    def write_json(self, path: str) -> None:
+        """
+        Writes to_dict() out as JSON.
+
+        :param path: File to write to.
+        :return: None
+        """
+        _write_atomic(path, json.dumps(self.to_dict(), indent=2))
+
+        return None
+
+    def write_prometheus(self, path: str) -> None:
+        """
+        Writes the metrics in the Prometheus text format, for the node_exporter textfile collector.
+
+        :param path: File to write to. Should end in ".prom"
+        :return: None
+        """
+        _write_atomic(path, self.prometheus_text())
+
+        return None
+
+    def prometheus_text(self) -> str:
+        """
+        The per method stats are totals since the process started, so the counters only go up.
+        The named counters are those of the current run.
+
+        :return: str: The metrics in the Prometheus text format.
+        """
+        data = self.to_dict()
+        with self._lock:
+            data['methods'] = {method: stats.to_dict() for method, stats in sorted(self._totals.items())}
+        lines = []
+
+        per_method = [
+            ('calls', 'slack_autoarchive_api_calls_total', 'counter', 'API calls made'),
+            ('bytes_sent', 'slack_autoarchive_api_bytes_sent_total', 'counter', 'Request bytes sent'),
+            ('bytes_received', 'slack_autoarchive_api_bytes_received_total', 'counter', 'Response bytes received'),
+            ('rate_limited', 'slack_autoarchive_api_rate_limited_total', 'counter', '429 responses'),
+            ('retry_sleep', 'slack_autoarchive_api_retry_sleep_seconds_total', 'counter', 'Seconds slept for retry-after'),
+            ('pacing_wait', 'slack_autoarchive_api_pacing_wait_seconds_total', 'counter', 'Seconds waited for the rate limiter'),
+        ]
+        for key, name, metric_type, help_text in per_method:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for method, stats in data['methods'].items():
+                lines.append(f'{name}{{method="{method}"}} {stats[key]}')
+
+        name = 'slack_autoarchive_api_latency_seconds'
+        lines.append(f'# HELP {name} API call latency')
+        lines.append(f'# TYPE {name} summary')
+        for method, stats in data['methods'].items():
+            for quantile in (50, 95, 99):
+                lines.append(f'{name}{{method="{method}",quantile="0.{quantile}"}} {stats[f"latency_p{quantile}"]}')
+            lines.append(f'{name}_sum{{method="{method}"}} {stats["latency_total"]}')
+            lines.append(f'{name}_count{{method="{method}"}} {stats["calls"]}')
+
+        for counter, value in data['counters'].items():
+            name = f'slack_autoarchive_{counter}'
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _write_atomic(path: str, text: str) -> None:
+    tmp_path = path + '.tmp'
+    with open(tmp_path, mode='w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """
+    Returns the Metrics shared by every thread in this process.
+
+    :return: Metrics
+    """
+    return _metrics
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the script against several workspaces at once, each in its own process
+with its own token, settings, rate limiter and HTTP session.
+
+    python3 multi_workspace.py workspaces.json
+
+workspaces.json is a list with one entry per workspace. "name" and a token are required.
+Every other key is a setting from config.py that replaces the env var for that workspace:
+
+    [
+        {"name": "acme", "API_TOKEN_ENV": "ACME_TOKEN", "DAYS_INACTIVE": 60},
+        {"name": "acme-eu", "API_TOKEN_ENV": "ACME_EU_TOKEN"}
+    ]
+
+"API_TOKEN_ENV" names the env var holding the token, so tokens don't have to be kept in the file.
+"API_TOKEN" can be used instead. An entry with neither is an error, so a workspace is never run with
+the API_TOKEN env var meant for another.
+
+Each workspace runs in its own directory (--dir/<name>), so results, caches, checkpoints
+and logs.log are kept apart. Relative paths in the settings are relative to that directory.
+A merged summary of every workspace is printed and saved to --summary.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import main
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from config import load_config, setup_logging
+from metrics import get_metrics
+from typing import Dict, List
+
+SETTINGS_SKIPPED = ('name', 'API_TOKEN_ENV')
+
+
+def load_workspaces(path: str) -> List[Dict]:
+    """
+    Reads and checks a workspaces file. See the top of this module for the format.
+
+    :param path: JSON file to read.
+    :return: List of workspace entries.
+    """
+    with open(path, encoding='utf-8') as f:
+        workspaces = json.load(f)
+
+    if not isinstance(workspaces, list) or not workspaces:
+        raise ValueError(f'{path} must be a list of workspaces.')
+
+    names = set()
+    for number, workspace in enumerate(workspaces, start=1):
+        name = workspace.get('name')
+        if not name:
+            raise ValueError(f'{path} workspace {number}: "name" is required.')
+        if name in names:
+            raise ValueError(f'{path} workspace {number}: "{name}" is listed more than once.')
+        if os.path.basename(name) != name:
+            raise ValueError(f'{path} workspace {number}: "{name}" can\'t be used as a directory name.')
+        if not workspace.get('API_TOKEN') and not workspace.get('API_TOKEN_ENV'):
+            raise ValueError(f'{path} workspace {number}: "API_TOKEN" or "API_TOKEN_ENV" is required.')
+        names.add(name)
+
+    return workspaces
+
+
+def get_settings(workspace: Dict) -> Dict:
+    """
+    :param workspace: Entry from load_workspaces().
+    :return: Dict of the settings to pass to load_config(), with API_TOKEN read from API_TOKEN_ENV if set.
+    """
+    settings = {key: value for key, value in workspace.items() if key not in SETTINGS_SKIPPED}
+
+    if workspace.get('API_TOKEN_ENV'):
+        settings['API_TOKEN'] = os.environ.get(workspace['API_TOKEN_ENV'], '')
+        if not settings['API_TOKEN']:
+            raise ValueError(f"{workspace['name']}: {workspace['API_TOKEN_ENV']} is not set.")
+
+    return settings
+
+
+def run_workspace(name: str, settings: Dict, directory: str) -> Dict:
+    """
+    Runs a single workspace. Called in a worker process of its own.
+
+    :param name: Workspace name.
+    :param settings: From get_settings().
+    :param directory: Directory to run in. Created if missing.
+    :return: Dict with the workspace's summary, wall time, API calls made and any error.
+    """
+    os.makedirs(directory, exist_ok=True)
+    os.chdir(directory)  # Only affects this worker process
+
+    start = time.perf_counter()
+    summary = None
+    error = ''
+
+    try:
+        config = load_config(**settings)
+        setup_logging(config)
+        with open(os.devnull, mode='w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull  # Output from every worker at once isn't readable
+            try:
+                summary = main.run(config)
+            finally:
+                sys.stdout = stdout
+    except (Exception, SystemExit) as e:
+        error = str(e) or type(e).__name__
+        logging.exception(f'{name} failed.')
+
+    methods = get_metrics().to_dict()['methods']
+
+    return {
+        'name': name,
+        'directory': directory,
+        'results_file': os.path.join(directory, settings.get('RESULTS_FILE', 'results.csv')),
+        'summary': summary,
+        'wall_time': round(time.perf_counter() - start, 3),
+        'api_calls': sum(stats['calls'] for stats in methods.values()),
+        'rate_limited': sum(stats['rate_limited'] for stats in methods.values()),
+        'error': error,
+    }
+
+
+def run_workspaces(workspaces: List[Dict], base_dir: str, processes: int = 0) -> Dict:
+    """
+    Runs every workspace, up to "processes" at once.
+
+    :param workspaces: From load_workspaces().
+    :param base_dir: Each workspace runs in base_dir/<name>.
+    :param processes: Workspaces run at the same time. 0 = all of them.
+    :return: Dict: Merged summary with a "workspaces" list of run_workspace() results and "totals".
+    """
+    jobs = [
+        (workspace['name'], get_settings(workspace), os.path.abspath(os.path.join(base_dir, workspace['name'])))
+        for workspace in workspaces
+    ]
+
+    start = time.perf_counter()
+    results = {}
+
+    # spawn: Workers start clean instead of copying this process's threads and open connections
+    # max_tasks_per_child: A new process for every workspace, so nothing is carried over from the last one
+    # (metrics, joined channels, open stores, etc.) when there are more workspaces than processes
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(
+            max_workers=processes or len(jobs), mp_context=context, max_tasks_per_child=1
+    ) as executor:
+        futures = {executor.submit(run_workspace, *job): job[0] for job in jobs}
+        for future in as_completed(futures):
+            result = future.result()
+            results[result['name']] = result
+            status = f"failed: {result['error']}" if result['error'] else 'done'
+            print(f"{result['name']}: {status} in {result['wall_time']:.1f} s")
+
+    ordered = [results[name] for name, _, _ in jobs]
+    done = [result['summary'] for result in ordered if result['summary']]
+
+    return {
+        'wall_time': round(time.perf_counter() - start, 3),
+        'slowest_workspace_time': max(result['wall_time'] for result in ordered),
+        'totals': {
+            'workspaces': len(ordered),
+            'failed_workspaces': sum(1 for result in ordered if result['error']),
+            'results': sum(summary['results'] for summary in done),
+            'archived': sum(summary['archived'] for summary in done),
+            'failed': sum(summary['failed'] for summary in done),
+            'api_calls': sum(result['api_calls'] for result in ordered),
+        },
+        'workspaces': ordered,
+    }
+
+
+def print_summary(merged: Dict) -> None:
+    """
+    Prints the merged summary from run_workspaces() as a table.
+
+    :param merged: From run_workspaces().
+    :return: None
+    """
+    print(f"\n{'Workspace':<24}{'Results':>9}{'Archived':>10}{'Failed':>8}{'Calls':>8}{'429s':>6}{'Time s':>9}")
+    print('-' * 74)
+
+    for result in merged['workspaces']:
+        summary = result['summary'] or {'results': '-', 'archived': '-', 'failed': '-'}
+        print(
+            f"{result['name']:<24}{summary['results']:>9}{summary['archived']:>10}{summary['failed']:>8}"
+            f"{result['api_calls']:>8}{result['rate_limited']:>6}{result['wall_time']:>9.1f}"
+        )
+        if result['error']:
+            print(f"    Error: {result['error']}")
+
+    totals = merged['totals']
+    print('-' * 74)
+    print(
+        f"{'Total':<24}{totals['results']:>9}{totals['archived']:>10}{totals['failed']:>8}"
+        f"{totals['api_calls']:>8}{'':>6}{merged['wall_time']:>9.1f}"
+    )
+    print(f"Slowest workspace: {merged['slowest_workspace_time']:.1f} s")
+
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archives inactive Slack channels in several workspaces at once.')
+    parser.add_argument('workspaces', help='JSON file listing the workspaces.')
+    parser.add_argument('--dir', default='workspaces', help='Each workspace runs in DIR/<name>.')
+    parser.add_argument('--processes', type=int, default=0, help='Workspaces run at the same time. 0 = all.')
+    parser.add_argument('--summary', default='summary.json', help='File to save the merged summary to.')
+    parser.add_argument('--yes', action='store_true', help="Don't ask before archiving.")
+    args = parser.parse_args()
+
+    workspaces = load_workspaces(args.workspaces)
+
+    live = [
+        workspace['name'] for workspace in workspaces
+        if not load_config(**get_settings(workspace)).DRY_RUN
+    ]
+    if live:
+        print(f"This IS NOT a dry run for: {', '.join(live)}. Channels will be archived.")
+        if not args.yes and input('Continue ("y/n")?: ').lower() != 'y':
+            print('Quitting program.')
+            sys.exit(1)
+
+    merged = run_workspaces(workspaces, args.dir, args.processes)
+    print_summary(merged)
+
+    with open(args.summary, mode='w', encoding='utf-8') as f:
+        json.dump(merged, f, indent=2)
+    print(f'Summary written to: {args.summary}')
+
+    if merged['totals']['failed_workspaces']:
+        sys.exit(1)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, Tuple
+
+# https://api.slack.com/docs/pagination
+START_PAGE_SIZE = 200  # What Slack recommends. Pages grow from here while responses stay fast.
+MIN_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000  # Most Slack accepts
+
+
+class PageSizer:
+    """
+    Thread safe page size for a single paginated Slack method.
+    Doubles after every fast page, up to the maximum.
+    Halves after a page that was rate limited or slow, down to MIN_PAGE_SIZE.
+    """
+
+    def __init__(self, maximum: int = MAX_PAGE_SIZE, slow_seconds: float = 2.0):
+        """
+        :param maximum: Largest page size to ask for.
+        :param slow_seconds: A page that takes longer than this is too big.
+        """
+        self.maximum = maximum
+        self.slow_seconds = slow_seconds
+        self._size = min(START_PAGE_SIZE, maximum)
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """
+        :return: int: Page size to ask for next.
+        """
+        with self._lock:
+            return self._size
+
+    def record(self, latency: float, rate_limited: bool = False) -> int:
+        """
+        Adjusts the page size after a page came back.
+
+        :param latency: Seconds the request for the page took.
+        :param rate_limited: True if Slack returned a 429 before the page came back.
+        :return: int: The new page size.
+        """
+        with self._lock:
+            if rate_limited or latency > self.slow_seconds:
+                self._size = max(min(MIN_PAGE_SIZE, self.maximum), self._size // 2)
+            else:
+                self._size = min(self.maximum, self._size * 2)
+
+            return self._size
+
+
+_sizers: Dict[str, PageSizer] = {}  # One PageSizer per Slack method
+_sizers_lock = threading.Lock()
+
+
+def get_page_sizer(method: str, maximum: int = MAX_PAGE_SIZE, slow_seconds: float = 2.0) -> PageSizer:
+    """
+    Returns the PageSizer shared by every thread in this process for the given method,
+    so what one listing learned is used by the next.
+
+    :param method: Slack API method name. Ex. "conversations.list"
+    :param maximum: Largest page size to ask for. Updated if the config changed.
+    :param slow_seconds: A page that takes longer than this is too big. Updated if the config changed.
+    :return: PageSizer
+    """
+    with _sizers_lock:
+        if method not in _sizers:
+            _sizers[method] = PageSizer(maximum, slow_seconds)
+
+        sizer = _sizers[method]
+        sizer.maximum = maximum
+        sizer.slow_seconds = slow_seconds
+
+    return sizer
+
+
+def prefetch_pages(
+        fetch: Callable[[str], Tuple[Dict, str]],
+        cursor: str = ''
+) -> Iterator[Tuple[Dict, str]]:
+    """
+    Yields every page from the given cursor on.
+    The next page is requested in a background thread while the caller works on the current one.
+    The first page is requested in the caller's thread, so a listing with a single page doesn't start a thread.
+
+    :param fetch: Called with a cursor. Returns (response, cursor for the next page or '' if done).
+    :param cursor: Cursor to start from. Empty string = the first page.
+    :return: Iterator of (response, cursor for the next page or '' if done)
+    """
+    response, cursor = fetch(cursor)
+    if not cursor:
+        yield response, cursor
+        return
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        while cursor:
+            next_page = executor.submit(fetch, cursor)
+            yield response, cursor
+            response, cursor = next_page.result()  # Re-raises anything fetch() raised, including SystemExit
+
+        yield response, cursor
+    finally:
+        executor.shutdown(wait=False)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from typing import Dict
+
+# https://api.slack.com/docs/rate-limits
+# Requests per minute allowed for each tier. Slack applies the limit to each method separately.
+TIER_LIMITS = {
+    1: 1,
+    2: 20,
+    3: 50,
+    4: 100,
+    'special': 60,  # chat.postMessage: roughly 1 per second
+}
+
+# Tier of every method this script calls. Methods not listed here use DEFAULT_TIER.
+METHOD_TIERS = {
+    'auth.test': 4,
+    'chat.postMessage': 'special',
+    'conversations.archive': 2,
+    'conversations.history': 3,
+    'conversations.info': 3,
+    'conversations.join': 3,
+    'conversations.list': 2,
+    'conversations.members': 4,
+    'files.upload': 2,
+    'users.info': 4,
+    'users.list': 2,
+}
+DEFAULT_TIER = 2
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket.
+    Callers reserve a token and then sleep until it is theirs,
+    so waiting threads are served in order instead of all waking at once.
+    """
+
+    def __init__(self, per_minute: float, capacity: int = 1):
+        """
+        :param per_minute: How many tokens are added per minute.
+        :param capacity: How many tokens can be saved up for a burst.
+        """
+        self.interval = 60.0 / per_minute  # Seconds between tokens
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) / self.interval)
+            self._updated = now
+
+    def acquire(self) -> float:
+        """
+        Takes a token, sleeping until one is available.
+
+        :return: float: Seconds spent waiting.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1  # Can go negative. Each waiting caller owns one "future" token.
+            wait = max(0.0, self._updated - now) + max(0.0, -self._tokens) * self.interval
+
+        if wait:
+            time.sleep(wait)
+
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stops handing out tokens for the given number of seconds.
+        Used when Slack says the limit was reached anyway.
+
+        :param seconds: How long to pause for.
+        :return: None
+        """
+        with self._lock:
+            now = time.monotonic()
+            resume = now + seconds
+            if resume > self._updated:
+                self._refill(now)
+                self._tokens = min(self._tokens, 1.0)
+                self._updated = resume
+
+        return None
+
+
+class RateLimiter:
+    """
+    Keeps a TokenBucket for each Slack API method, sized by the method's tier.
+    """
+
+    def __init__(self, headroom: float = 0.9):
+        """
+        :param headroom: Fraction of each tier limit to use. Stays just under Slack's limit.
+        """
+        self.headroom = headroom
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, method: str) -> TokenBucket:
+        """
+        :param method: Slack API method name. Ex. "conversations.list"
+        :return: TokenBucket: The bucket for the given method.
+        """
+        with self._lock:
+            if method not in self._buckets:
+                tier = METHOD_TIERS.get(method, DEFAULT_TIER)
+                per_minute = TIER_LIMITS[tier] * self.headroom
+                capacity = max(1, int(per_minute // 10))
+                self._buckets[method] = TokenBucket(per_minute, capacity)
+
+            return self._buckets[method]
+
+    def acquire(self, method: str) -> float:
+        """
+        Waits until a call to the given method is allowed.
+
+        :param method: Slack API method name.
+        :return: float: Seconds spent waiting.
+        """
+        return self.bucket(method).acquire()
+
+    def throttled(self, method: str, retry_after: float) -> None:
+        """
+        Pauses the given method after Slack returned a 429.
+
+        :param method: Slack API method name.
+        :param retry_after: Value of the retry-after header.
+        :return: None
+        """
+        self.bucket(method).pause(retry_after)
+
+        return None
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter(headroom: float = 0.9) -> RateLimiter:
+    """
+    Returns the rate limiter shared by every thread in this process.
+
+    :param headroom: Fraction of each tier limit to use. Only used on first call.
+    :return: RateLimiter
+    """
+    global _limiter
+
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter(headroom)
+
+    return _limiter
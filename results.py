@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import logging
+import os
+import shutil
+import time
+import zipfile
+from messages import dashes
+from metrics import get_metrics
+from typing import Dict
+
+HEADERS = ['Channel ID', 'Channel Name', 'Users', 'Successfully Archived?', 'Channel Link']
+# Tables in the export zip. Members get a row each instead of sharing one cell.
+EXPORT_CHANNEL_HEADERS = ['Channel ID', 'Channel Name', 'Members', 'Successfully Archived?', 'Channel Link']
+EXPORT_MEMBER_HEADERS = ['Channel ID', 'Member']
+
+
+class ResultsWriter:
+    """
+    Writes archive results out one row at a time as each channel is decided.
+    Rows go to a temporary file that is flushed after every row, so a crash keeps everything decided so far.
+    The temporary file replaces the results file only once the run completes.
+
+    If export_path is set, the same results are also written as a zip of two CSV tables:
+    channels.csv with one row per channel and members.csv with one row per channel member.
+    Both tables are written to temporary files as rows come in and compressed into the zip at the end.
+
+    Use as a context manager:
+        with ResultsWriter('results.csv', team_id) as writer:
+            writer.write(result)
+    """
+
+    def __init__(self, path: str, team_id: str, export_path: str = ''):
+        """
+        :param path: File to write the results to.
+        :param team_id: Slack instance team ID. Used to build channel links.
+        :param export_path: Zip file to write the export to. Blank = no export.
+        """
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.team_id = team_id
+        self.export_path = export_path
+        self.rows = 0
+        self._corrections = {}
+        self._file = None
+        self._writer = None
+        self._export_files = {}  # Table name: open temporary file
+        self._export_writers = {}  # Table name: csv writer
+
+    def __enter__(self) -> 'ResultsWriter':
+        try:
+            self._file = open(self.tmp_path, mode='w', encoding='utf-8', newline='')
+            self._writer = csv.writer(self._file, quoting=csv.QUOTE_ALL)
+            self._writer.writerow(HEADERS)
+            self._file.flush()
+        except OSError:
+            print(f'Error opening: {self.tmp_path}')
+            print('Continuing script. Data will be in the log file.')
+            self._file = None
+
+        if self.export_path and self._file is not None:
+            self._open_export()
+
+        return self
+
+    def _open_export(self) -> None:
+        tables = (('channels', EXPORT_CHANNEL_HEADERS), ('members', EXPORT_MEMBER_HEADERS))
+
+        try:
+            for table, headers in tables:
+                export_file = open(f'{self.export_path}.{table}.tmp', mode='w', encoding='utf-8', newline='')
+                self._export_files[table] = export_file
+                self._export_writers[table] = csv.writer(export_file)
+                self._export_writers[table].writerow(headers)
+        except OSError as e:
+            print(f'Error opening the export files for: {self.export_path}')
+            logging.warning(f'Error opening the export files for {self.export_path}: {e}. Skipping the export.')
+            self._close_export(remove=True)
+
+        return None
+
+    def _close_export(self, remove: bool = False) -> None:
+        for export_file in self._export_files.values():
+            export_file.close()
+            if remove:
+                os.remove(export_file.name)
+
+        if remove:
+            self._export_files = {}
+            self._export_writers = {}
+
+        return None
+
+    def _discard_export(self) -> None:
+        # The export from an earlier run goes too, so it isn't sent in place of this run's CSV
+        paths = [export_file.name for export_file in self._export_files.values()]
+        paths += [self.export_path + '.tmp', self.export_path]
+
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        self._export_files = {}
+        self._export_writers = {}
+
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if self._file is None:
+            return None
+
+        self._file.close()
+        self._close_export(remove=exc_type is not None)
+
+        if exc_type is None:
+            if self._corrections:
+                self._apply_corrections()
+            if self._export_files:
+                try:
+                    self._write_export()
+                except OSError as e:
+                    # The CSV is complete, so it still replaces the last results
+                    print(f'Error writing the export: {self.export_path}')
+                    logging.warning(f'Error writing the export {self.export_path}: {e}. Only the CSV was written.')
+                    self._discard_export()
+            os.replace(self.tmp_path, self.path)
+        else:
+            # Leave the previous results file alone. The partial results stay in tmp_path.
+            print(f'Run did not complete. Partial results are in: {self.tmp_path}')
+            logging.warning(f'Run did not complete. Partial results are in: {self.tmp_path}')
+
+        return None
+
+    def write(self, result: Dict) -> None:
+        """
+        Writes out a single result from evaluate_channel().
+
+        :param result: Dict with "id", "name", "users" and "archived" keys.
+        :return: None
+        """
+        self.rows += 1
+
+        if self._file is None:
+            logging.critical(f"Channel: {result['name']}")
+            channel_users = '\n'.join(result['users'])
+            logging.critical(channel_users)
+            logging.critical(dashes)
+            return None
+
+        channel_id = result['id']
+        channel_link = f'https://app.slack.com/client/{self.team_id}/{channel_id}'
+
+        if result['archived']:
+            archived = 'Yes'
+        else:
+            archived = 'No'
+
+        row = [
+            channel_id,
+            result['name'],
+            '\n'.join(result['users']),
+            archived,
+            channel_link,
+        ]
+
+        self._writer.writerow(row)
+        self._file.flush()
+
+        if self._export_writers:
+            self._export_writers['channels'].writerow(
+                [channel_id, result['name'], len(result['users']), archived, channel_link]
+            )
+            self._export_writers['members'].writerows([channel_id, user] for user in result['users'])
+
+        return None
+
+    def correct(self, corrections: Dict[str, bool]) -> None:
+        """
+        Changes the "Successfully Archived?" column of rows that were already written.
+        The changes are applied when the writer is closed.
+
+        :param corrections: Dict of channel ID: archived
+        :return: None
+        """
+        self._corrections.update(corrections)
+
+        return None
+
+    def _apply_corrections(self) -> None:
+        # Copy the rows across one at a time so the results are never all in memory
+        fixed_path = self.tmp_path + '.fixed'
+        column = HEADERS.index('Successfully Archived?')
+
+        with open(self.tmp_path, encoding='utf-8', newline='') as src, \
+                open(fixed_path, mode='w', encoding='utf-8', newline='') as dst:
+            writer = csv.writer(dst, quoting=csv.QUOTE_ALL)
+            for row in csv.reader(src):
+                if row and row[0] in self._corrections:
+                    row[column] = 'Yes' if self._corrections[row[0]] else 'No'
+                writer.writerow(row)
+
+        os.replace(fixed_path, self.tmp_path)
+
+    def _write_export(self) -> None:
+        # Streams both tables into the zip, so the results are never all in memory
+        start = time.perf_counter()
+        tmp_zip = self.export_path + '.tmp'
+        column = EXPORT_CHANNEL_HEADERS.index('Successfully Archived?')
+        channels_path = self._export_files['channels'].name
+        members_path = self._export_files['members'].name
+
+        with zipfile.ZipFile(tmp_zip, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
+            with open(channels_path, encoding='utf-8', newline='') as src, \
+                    io.TextIOWrapper(zf.open('channels.csv', mode='w'), encoding='utf-8', newline='') as dst:
+                writer = csv.writer(dst)
+                for row in csv.reader(src):
+                    if row and row[0] in self._corrections:
+                        row[column] = 'Yes' if self._corrections[row[0]] else 'No'
+                    writer.writerow(row)
+
+            with open(members_path, mode='rb') as src, zf.open('members.csv', mode='w') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+
+        os.replace(tmp_zip, self.export_path)
+        os.remove(channels_path)
+        os.remove(members_path)
+        self._export_files = {}
+        self._export_writers = {}
+
+        elapsed = time.perf_counter() - start
+        csv_size = os.path.getsize(self.tmp_path)
+        export_size = os.path.getsize(self.export_path)
+        ratio = export_size / csv_size if csv_size else 0.0
+
+        metrics = get_metrics()
+        metrics.set('results_csv_bytes', csv_size)
+        metrics.set('results_export_bytes', export_size)
+        metrics.set('results_export_seconds', round(elapsed, 3))
+
+        print(f"Export written to: {self.export_path} ({ratio:.0%} of the CSV's size)")
+        logging.info(
+            f'Export written to {self.export_path} in {elapsed:.2f} seconds. '
+            f'{export_size} bytes vs {csv_size} bytes for the CSV ({ratio:.0%}).'
+        )
+
+        return None
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Exemption rules, compiled once and reused for every channel.
+
+Rules come from the *_RAW lists in config.py and, optionally, a rules file with one entry per line:
+
+    # Lines starting with "#" are ignored
+    [exempt_channels]
+    general
+    proj-*
+
+    [keywords]
+    %noarchive
+
+    [exempt_subtypes]
+    channel_join
+    channel_leave
+
+Channel names containing "*", "?" or "[" are treated as glob patterns. Ex. "proj-*"
+"""
+
+import fnmatch
+import re
+from typing import Dict, Iterable, List, Optional
+
+SECTIONS = ('exempt_channels', 'keywords', 'exempt_subtypes')
+GLOB_CHARS = ('*', '?', '[')
+
+
+def parse_raw(raw: str) -> List[str]:
+    """
+    Turns one of the multi-line *_RAW strings from config.py into a list.
+
+    :param raw: One entry per line. Blank lines are ignored.
+    :return: list: The entries with surrounding whitespace removed.
+    """
+    return [x.strip() for x in raw.splitlines() if x.strip()]
+
+
+def load_rules_file(path: str) -> Dict[str, List[str]]:
+    """
+    Reads a rules file. See the top of this module for the format.
+
+    :param path: File to read.
+    :return: Dict of section name: entries.
+    """
+    rules = {section: [] for section in SECTIONS}
+    section = None
+
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            if line.startswith('[') and line.endswith(']'):
+                section = line[1:-1].strip()
+                if section not in rules:
+                    raise ValueError(f'{path} line {line_number}: Unknown section [{section}]')
+                continue
+
+            if section is None:
+                raise ValueError(f'{path} line {line_number}: Entry is not under a [section]')
+
+            rules[section].append(line)
+
+    return rules
+
+
+class ExemptionRules:
+    """
+    Compiled form of the exemption rules:
+    - Exact channel names are kept in a set
+    - Channel name patterns are combined into a single regex
+    - Topic and purpose keywords are combined into a single regex
+    - Ignored message subtypes are kept in a set
+    """
+
+    def __init__(
+            self,
+            exempt_channels: Iterable[str] = (),
+            keywords: Iterable[str] = (),
+            exempt_subtypes: Iterable[str] = (),
+    ):
+        """
+        :param exempt_channels: Channel names or glob patterns that are never archived.
+        :param keywords: Channels with any of these in their topic or purpose are never archived.
+        :param exempt_subtypes: Message subtypes that don't count as activity.
+        """
+        names = set()
+        patterns = []
+        for name in exempt_channels:
+            if any(char in name for char in GLOB_CHARS):
+                patterns.append(fnmatch.translate(name))
+            else:
+                names.add(name)
+
+        self.exempt_channels = frozenset(names)
+        self.name_pattern = _combine(patterns)
+
+        # Longest first so the regex doesn't stop at a shorter keyword that is part of a longer one
+        keywords = sorted(set(keywords), key=len, reverse=True)
+        self.keyword_pattern = _combine([re.escape(keyword) for keyword in keywords])
+
+        self.exempt_subtypes = frozenset(exempt_subtypes)
+
+    def name_reason(self, name: str) -> str:
+        """
+        :param name: Channel name.
+        :return: str: Why the name makes the channel exempt. Empty string if it doesn't.
+        """
+        if name in self.exempt_channels:
+            return 'allow list'
+        if self.name_pattern and self.name_pattern.match(name):
+            return 'channel name pattern'
+
+        return ''
+
+    def text_reason(self, topic: str, purpose: str = '') -> str:
+        """
+        :param topic: Channel topic.
+        :param purpose: Channel purpose.
+        :return: str: Why the topic or purpose makes the channel exempt. Empty string if they don't.
+        """
+        if not self.keyword_pattern:
+            return ''
+        if topic and self.keyword_pattern.search(topic):
+            return 'channel topic'
+        if purpose and self.keyword_pattern.search(purpose):
+            return 'channel purpose'
+
+        return ''
+
+    def is_exempt_subtype(self, subtype: Optional[str]) -> bool:
+        """
+        :param subtype: Message subtype. None for regular messages.
+        :return: bool: True if messages of this subtype don't count as activity.
+        """
+        return subtype is not None and subtype in self.exempt_subtypes
+
+
+def _combine(patterns: List[str]) -> Optional[re.Pattern]:
+    if not patterns:
+        return None
+
+    return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns))
+
+
+def compile_rules(
+        exempt_channels_raw: str = '',
+        keywords_raw: str = '',
+        exempt_subtypes_raw: str = '',
+        rules_file: str = '',
+) -> ExemptionRules:
+    """
+    Builds ExemptionRules from the *_RAW strings in config.py plus an optional rules file.
+
+    :param exempt_channels_raw: EXEMPT_CHANNELS_RAW
+    :param keywords_raw: ALLOWLIST_KEYWORDS_RAW
+    :param exempt_subtypes_raw: EXEMPT_SUBTYPES_RAW
+    :param rules_file: Rules file to add to these. Blank = none.
+    :return: ExemptionRules
+    """
+    rules = {
+        'exempt_channels': parse_raw(exempt_channels_raw),
+        'keywords': parse_raw(keywords_raw),
+        'exempt_subtypes': parse_raw(exempt_subtypes_raw),
+    }
+
+    if rules_file:
+        for section, entries in load_rules_file(rules_file).items():
+            rules[section].extend(entries)
+
+    return ExemptionRules(**rules)
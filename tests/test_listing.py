@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+import main
+from config import load_config, set_config
+from fake_slack import Workspace, start_server
+
+
+class ListPagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = start_server(Workspace(channels=2000, users=20, seed=3, private_ratio=0.3), rate_scale=0)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        set_config(load_config({
+            'API_TOKEN': 'x', 'SLACK_API_URL': self.server.url, 'RATE_LIMIT_PERCENT': '1000000', 'PAGE_SIZE_MAX': '100',
+        }))
+
+    def list_channels(self):
+        pages = main.list_pages({'public_channel': '', 'private_channel': ''})
+        return [(types, channel['id']) for types, channels, _ in pages for channel in channels]
+
+    def test_one_type_at_a_time_in_the_same_order(self):
+        listed = self.list_channels()
+        types = [types for types, _ in listed]
+
+        self.assertEqual(types, sorted(types, key=lambda t: t != 'public_channel'))
+        self.assertIn('private_channel', types)
+        self.assertEqual(listed, self.list_channels())
+
+    def test_threads_stop_when_the_caller_stops_reading(self):
+        pages = main.list_pages({'public_channel': '', 'private_channel': ''})
+        next(pages)
+        pages.close()
+
+        deadline = time.time() + 5
+        while time.time() < deadline and any('list_type' in t.name for t in threading.enumerate()):
+            time.sleep(0.05)
+
+        self.assertFalse([t.name for t in threading.enumerate() if 'list_type' in t.name])
+
+
+if __name__ == '__main__':
+    unittest.main()
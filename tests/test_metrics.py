@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from metrics import LATENCY_SAMPLES, Metrics, percentile
+
+
+class PercentileTest(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_median_of_even_count_is_lower_middle(self):
+        self.assertEqual(percentile([1, 2, 3, 4, 5, 6], 50), 3)
+
+    def test_p99_of_100_is_not_the_max(self):
+        self.assertEqual(percentile(list(range(1, 101)), 99), 99)
+
+    def test_p100_is_the_max(self):
+        self.assertEqual(percentile([1, 2, 3], 100), 3)
+
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_latency_sample_is_bounded_and_total_is_exact(self):
+        metrics = Metrics()
+        for _ in range(LATENCY_SAMPLES * 3):
+            metrics.record_call('conversations.list', 0.5)
+
+        stats = metrics.to_dict()['methods']['conversations.list']
+        self.assertEqual(len(metrics._methods['conversations.list'].latencies), LATENCY_SAMPLES)
+        self.assertEqual(stats['calls'], LATENCY_SAMPLES * 3)
+        self.assertEqual(stats['latency_total'], LATENCY_SAMPLES * 3 * 0.5)
+        self.assertEqual(stats['latency_p50'], 0.5)
+
+    def test_reset_keeps_the_prometheus_totals(self):
+        metrics = Metrics()
+        metrics.record_call('conversations.list', 0.1)
+        metrics.add('join_calls_avoided', 3)
+        metrics.reset()
+        metrics.record_call('conversations.list', 0.1)
+
+        self.assertEqual(metrics.to_dict()['counters'], {})
+        self.assertEqual(metrics.to_dict()['methods']['conversations.list']['calls'], 1)
+        self.assertIn('slack_autoarchive_api_calls_total{method="conversations.list"} 2', metrics.prometheus_text())
+
+
+if __name__ == '__main__':
+    unittest.main()
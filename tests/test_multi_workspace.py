@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import unittest
+from fake_slack import Workspace, start_server
+from multi_workspace import run_workspaces
+
+
+class RunWorkspacesTest(unittest.TestCase):
+
+    def test_workspaces_sharing_a_process_are_kept_apart(self):
+        servers = {
+            'a': start_server(Workspace(channels=120, users=20, seed=1), rate_scale=0),
+            'b': start_server(Workspace(channels=80, users=20, seed=2), rate_scale=0),
+        }
+        for server in servers.values():
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        workspaces = [
+            {'name': name, 'API_TOKEN': f'token-{name}', 'SLACK_API_URL': server.url, 'RATE_LIMIT_PERCENT': 1000000}
+            for name, server in servers.items()
+        ]
+        merged = run_workspaces(workspaces, directory.name, processes=1)
+
+        for result in merged['workspaces']:
+            server = servers[result['name']]
+            self.assertEqual(result['error'], '')
+            self.assertEqual(result['api_calls'], sum(stats['calls'] for stats in server.get_stats().values()))
+            for name in ('channels.db', 'checkpoint.db', 'results.csv'):
+                self.assertTrue(os.path.exists(os.path.join(result['directory'], name)), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
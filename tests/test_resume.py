@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+import main
+from config import load_config, set_config
+from fake_slack import Workspace, start_server
+
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = start_server(Workspace(channels=600, users=20, seed=4), rate_scale=0)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory.name)
+
+        main._joined.clear()
+        set_config(load_config({
+            'API_TOKEN': 'x', 'SLACK_API_URL': self.server.url, 'RATE_LIMIT_PERCENT': '1000000', 'DRY_RUN': 'True',
+        }))
+
+    def join_calls(self) -> int:
+        return self.server.get_stats().get('conversations.join', {}).get('calls', 0)
+
+    def test_channels_joined_before_the_interruption_are_not_joined_again(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            main.get_checkpoint(main.get_config().CHECKPOINT_FILE).clear()
+            channels = list(main.iter_channels(refresh=True))
+            main.join_channels(channels[:300])  # The run stops here
+            before = self.join_calls()
+
+            main._joined.clear()  # As if in a new process
+            self.assertEqual(main.plan_joins(channels[:300]), [])
+            expected = len(main.plan_joins(channels[300:]))
+
+            main.run(resume=True, report=False)
+
+        self.assertGreater(before, 0)
+        self.assertEqual(self.join_calls() - before, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()